@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+V2Ray Management Tool - Probe & Selection Benchmark
+
+Starts hundreds of local synthetic nodes and runs them through the real
+probing and selection code of v2ray_command.py:
+
+1. TCP nodes: reachable, refused (closed port) or blackholed (SYNs dropped)
+2. TLS nodes: self-signed listeners with injected handshake delay, jitter,
+   random connection drops and blackholing
+
+Reports wall-clock time, accuracy against the known ground truth, peak
+thread count and peak Python memory, and appends every run to a JSON file
+so results can be compared across changes.
+
+Usage:
+    python3 v2ray_benchmark.py [--tcp-nodes 300] [--tls-nodes 100] [--timeout 1]
+                               [--repeat 3] [--output benchmark_results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import ssl
+import asyncio
+import shutil
+import tempfile
+import threading
+import tracemalloc
+import subprocess
+import contextlib
+import io
+import statistics
+from datetime import datetime
+
+import v2ray_command as v2ray
+
+DEFAULT_OUTPUT = "benchmark_results.json"
+
+# Share of each synthetic node behaviour
+TCP_MIX = {"online": 0.7, "refused": 0.15, "blackhole": 0.15}
+TLS_MIX = {"online": 0.8, "lossy": 0.1, "blackhole": 0.1}
+TLS_DELAY_RANGE = (5, 150)   # Injected handshake delay (ms)
+TLS_JITTER_MAX = 20          # Maximum injected jitter (ms)
+TLS_DROP_RATE = 0.5          # Connection drop probability of lossy nodes
+ACCURACY_TOLERANCE = 3       # A pick within this many ms of the true best counts as correct
+
+# ==================== Synthetic Nodes ====================
+class _DelayedTLSProtocol(asyncio.Protocol):
+    """Server side of a TLS node: wait, maybe drop, then run the TLS handshake"""
+
+    def __init__(self, spec, context):
+        self.spec = spec
+        self.context = context
+
+    def connection_made(self, transport):
+        # Keep the ClientHello in the kernel buffer until the delay has passed
+        transport.pause_reading()
+        asyncio.get_running_loop().create_task(self._handshake(transport))
+
+    async def _handshake(self, transport):
+        spec = self.spec
+        if spec["kind"] == "blackhole":
+            return  # Never answer; the client handshake times out
+        delay = spec["delay"] + random.uniform(-spec["jitter"], spec["jitter"])
+        await asyncio.sleep(max(delay, 0) / 1000)
+        if random.random() < spec["drop"]:
+            transport.abort()
+            return
+        try:
+            await asyncio.get_running_loop().start_tls(transport, self, self.context, server_side=True)
+        except (OSError, ConnectionError):
+            transport.abort()
+
+    def data_received(self, data):
+        pass
+
+
+class _ClosingProtocol(asyncio.Protocol):
+    """Server side of a plain TCP node: accept and hang up"""
+
+    def connection_made(self, transport):
+        transport.close()
+
+
+class SyntheticNodes:
+    """Run synthetic node listeners on a background event loop"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.servers = []
+        self.blackholes = []
+        self.temp_dir = tempfile.mkdtemp(prefix="v2ray-bench-")
+        self.tls_context = None
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        async def close_all():
+            for server in self.servers:
+                server.close()
+        asyncio.run_coroutine_threadsafe(close_all(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+        for sock in self.blackholes:
+            sock.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def _blackhole_port(self):
+        """Listener whose accept queue is full, so new SYNs are dropped"""
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(0)
+        filler = socket.create_connection(listener.getsockname())
+        self.blackholes.extend([listener, filler])
+        return listener.getsockname()[1]
+
+    def _refused_port(self):
+        """Port with nothing listening"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def _ensure_tls_context(self):
+        if self.tls_context is None:
+            cert = os.path.join(self.temp_dir, "cert.pem")
+            key = os.path.join(self.temp_dir, "key.pem")
+            subprocess.run(
+                ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", cert,
+                 "-days", "1", "-subj", "/CN=bench.local"],
+                check=True, capture_output=True
+            )
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(cert, key)
+            context.set_alpn_protocols(["h2", "http/1.1"])
+            self.tls_context = context
+        return self.tls_context
+
+    def add_tcp_node(self, index, kind):
+        """Create a plain TCP node of the given kind, returns (node, spec)"""
+        if kind == "online":
+            server = self._run(self.loop.create_server(_ClosingProtocol, "127.0.0.1", 0, backlog=1024))
+            self.servers.append(server)
+            port = server.sockets[0].getsockname()[1]
+        elif kind == "refused":
+            port = self._refused_port()
+        else:
+            port = self._blackhole_port()
+        node = v2ray.Node(name=f"bench-tcp-{index:04d}", server="127.0.0.1", port=port,
+                          protocol="vmess", uuid=f"bench-{index}", region="Bench")
+        return node, {"kind": kind}
+
+    def add_tls_node(self, index, kind):
+        """Create a TLS node of the given kind, returns (node, spec)"""
+        spec = {
+            "kind": kind,
+            "delay": random.uniform(*TLS_DELAY_RANGE),
+            "jitter": random.uniform(0, TLS_JITTER_MAX),
+            "drop": TLS_DROP_RATE if kind == "lossy" else 0.0
+        }
+        context = self._ensure_tls_context()
+        server = self._run(self.loop.create_server(
+            lambda: _DelayedTLSProtocol(spec, context), "127.0.0.1", 0, backlog=1024))
+        self.servers.append(server)
+        node = v2ray.Node(name=f"bench-tls-{index:04d}", server="127.0.0.1",
+                          port=server.sockets[0].getsockname()[1], protocol="vmess",
+                          uuid=f"bench-tls-{index}", tls="tls", sni="bench.local",
+                          alpn="h2,http/1.1", region="Bench")
+        return node, spec
+
+
+def _pick_kinds(count, mix):
+    """Deterministic list of node kinds following the mix ratios"""
+    kinds = []
+    for kind, share in mix.items():
+        kinds.extend([kind] * round(count * share))
+    kinds = (kinds + ["online"] * count)[:count]
+    random.shuffle(kinds)
+    return kinds
+
+# ==================== Measurement ====================
+class ResourceSampler:
+    """Track peak thread count and peak traced Python memory during a block"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak_threads = 0
+        self.peak_memory = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_threads = max(self.peak_threads, threading.active_count() - 1)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        tracemalloc.start()
+        self.start_time = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.start_time
+        self._stop.set()
+        self._thread.join()
+        self.peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    def metrics(self):
+        return {
+            "wall_time": round(self.elapsed, 3),
+            "peak_threads": self.peak_threads,
+            "peak_memory_kb": round(self.peak_memory / 1024, 1)
+        }
+
+
+def _quiet():
+    """Silence the table/progress output of the code under test"""
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def _classification_accuracy(results, specs, online_kinds):
+    """Share of nodes whose online/offline status matches the ground truth"""
+    by_name = {r["name"]: r for r in results}
+    correct = 0
+    for name, spec in specs.items():
+        result = by_name.get(name)
+        expected_online = spec["kind"] in online_kinds
+        actual_online = bool(result) and result["status"] == "online"
+        correct += expected_online == actual_online
+    return round(correct / len(specs), 4) if specs else None
+
+
+def _pick_accuracy(best, specs):
+    """1 if the picked node is within ACCURACY_TOLERANCE of the true best delay"""
+    candidates = [spec["delay"] for spec in specs.values() if spec["kind"] == "online"]
+    if not best or not candidates:
+        return 0
+    return int(specs[best["name"]]["delay"] <= min(candidates) + ACCURACY_TOLERANCE)
+
+
+def run_benchmark(tcp_nodes=300, tls_nodes=100, timeout=1.0, repeat=3, seed=None):
+    """Run all scenarios and return a result record"""
+    seed = seed if seed is not None else random.randrange(1 << 30)
+    random.seed(seed)
+    scenarios = {}
+
+    with SyntheticNodes() as synthetic:
+        tcp = [synthetic.add_tcp_node(i, kind) for i, kind in enumerate(_pick_kinds(tcp_nodes, TCP_MIX))]
+        tcp_specs = {node["name"]: spec for node, spec in tcp}
+        tcp_list = [node for node, _ in tcp]
+
+        tls = [synthetic.add_tls_node(i, kind) for i, kind in enumerate(_pick_kinds(tls_nodes, TLS_MIX))]
+        tls_specs = {node["name"]: spec for node, spec in tls}
+        tls_list = [node for node, _ in tls]
+
+        # 1. Single-node latency test (sequential calls, as menu 21/22 use it)
+        sample = [n for n in tcp_list if tcp_specs[n["name"]]["kind"] == "online"][:20]
+        with ResourceSampler() as sampler, _quiet():
+            for node in sample:
+                v2ray.test_node_latency(node, timeout=timeout)
+        scenarios["test_node_latency"] = {**sampler.metrics(), "nodes": len(sample),
+                                          "per_call_ms": round(sampler.elapsed / max(len(sample), 1) * 1000, 2)}
+
+        # 2. Full TCP sweep through test_all_nodes' engine
+        runs = []
+        for _ in range(repeat):
+            v2ray.DNS_CACHE.clear()
+            with ResourceSampler() as sampler, _quiet():
+                results = v2ray.probe_nodes(tcp_list, timeout=timeout)
+            runs.append({**sampler.metrics(),
+                         "accuracy": _classification_accuracy(results, tcp_specs, {"online"})})
+        scenarios["tcp_probe_all"] = _aggregate(runs, nodes=len(tcp_list))
+
+        # 3. Full TLS sweep with injected delay/jitter/loss
+        runs = []
+        for _ in range(repeat):
+            with ResourceSampler() as sampler, _quiet():
+                results = v2ray.probe_nodes(tls_list, timeout=timeout, mode="tls", verify_tls=False)
+            online = [r for r in results if r["status"] == "online"]
+            best = min(online, key=v2ray.node_rank_score) if online else None
+            runs.append({**sampler.metrics(),
+                         "accuracy": _classification_accuracy(results, tls_specs, {"online", "lossy"}),
+                         "pick_accuracy": _pick_accuracy(best, tls_specs)})
+        scenarios["tls_probe_all"] = _aggregate(runs, nodes=len(tls_list))
+
+        # 4. Adaptive selection against the TLS ground truth
+        runs = []
+        for _ in range(repeat):
+            with ResourceSampler() as sampler, _quiet():
+                best = v2ray.select_best_node(tls_list, time_budget=max(timeout * 10, 5),
+                                              mode="tls", verify_tls=False)
+            runs.append({**sampler.metrics(), "pick_accuracy": _pick_accuracy(best, tls_specs)})
+        scenarios["select_best_node"] = _aggregate(runs, nodes=len(tls_list))
+
+    return {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "seed": seed,
+        "params": {"tcp_nodes": tcp_nodes, "tls_nodes": tls_nodes, "timeout": timeout, "repeat": repeat},
+        "scenarios": scenarios
+    }
+
+
+def _aggregate(runs, **extra):
+    """Median of each numeric metric over repeated runs"""
+    keys = runs[0].keys()
+    return {**extra, "runs": len(runs),
+            **{key: round(statistics.median(run[key] for run in runs), 4) for key in keys}}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+# ==================== Reporting ====================
+def save_result(record, output):
+    """Append a run record to the JSON results file"""
+    history = []
+    if os.path.exists(output):
+        with open(output, 'r', encoding='utf-8') as f:
+            history = json.load(f)
+    history.append(record)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(history, f, indent=2)
+    return history
+
+
+def print_report(record, previous=None):
+    """Print a run, with deltas against the previous run when available"""
+    Colors = v2ray.Colors
+    print(f"\n{Colors.HEADER}Probe & Selection Benchmark{Colors.END} "
+          f"(commit {record['commit'] or 'unknown'}, seed {record['seed']})")
+    print("=" * 78)
+    for name, metrics in record["scenarios"].items():
+        print(f"{Colors.BOLD}{name}{Colors.END}")
+        for key, value in metrics.items():
+            delta = ""
+            if previous and isinstance(value, (int, float)):
+                old = previous.get("scenarios", {}).get(name, {}).get(key)
+                if isinstance(old, (int, float)) and old:
+                    delta = f"  ({(value - old) / old * 100:+.1f}% vs previous)"
+            print(f"  {key:<16} {value}{delta}")
+    print("=" * 78)
+
+
+def main():
+    options = v2ray.parse_cli_options(sys.argv[1:])
+    if "--help" in sys.argv or "-h" in sys.argv:
+        print(__doc__)
+        return 0
+
+    output = options.get("output", DEFAULT_OUTPUT)
+
+    # Keep history/log writes of the code under test out of the real config dirs
+    with tempfile.TemporaryDirectory(prefix="v2ray-bench-state-") as work_dir:
+        v2ray.CONFIG.CONFIG_DIR = work_dir
+        v2ray.CONFIG.NODE_STORE_FILE = os.path.join(work_dir, "nodes.db")
+        v2ray.CONFIG.SUBSCRIPTION_FILE = os.path.join(work_dir, "subscription.json")
+        v2ray.CONFIG.HISTORY_FILE = os.path.join(work_dir, "node_history.json")
+        v2ray.CONFIG.LOG_FILE = os.path.join(work_dir, "v2ray_command.log")
+        try:
+            record = run_benchmark(
+                tcp_nodes=int(options.get("tcp-nodes", 300)),
+                tls_nodes=int(options.get("tls-nodes", 100)),
+                timeout=float(options.get("timeout", 1.0)),
+                repeat=int(options.get("repeat", 3)),
+                seed=int(options["seed"]) if "seed" in options else None
+            )
+        finally:
+            v2ray.close_node_store()
+    history = save_result(record, output)
+    print_report(record, history[-2] if len(history) > 1 else None)
+    print(f"Results appended to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -30,13 +30,26 @@ import socket
 import requests
 import tempfile
 import shutil
+import shlex
 import configparser
 import platform
 import abc
+import asyncio
+import collections.abc
+import statistics
+import ssl
+import ipaddress
+import functools
+import re
+import threading
+import sqlite3
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
 from urllib.parse import urlparse, unquote, parse_qs
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib3.util.retry import Retry
 from datetime import datetime
 from pathlib import Path
+from xml.sax.saxutils import escape as xml_escape
 
 # ==================== Platform Detection ====================
 PLATFORM = platform.system().lower()
@@ -65,7 +78,11 @@ class Config:
             self.SHELL_CONFIG_DIR = "/etc/profile.d"
         
         self.CONFIG_FILE = os.path.join(self.CONFIG_DIR, "config.json")
+        self.SUBSCRIPTION_CACHE_FILE = os.path.join(self.CONFIG_DIR, "subscription_cache.json")
+        self.NODE_STORE_FILE = os.path.join(self.CONFIG_DIR, "nodes.db")
+        # Earlier JSON state, imported into NODE_STORE_FILE on first use
         self.SUBSCRIPTION_FILE = os.path.join(self.CONFIG_DIR, "subscription.json")
+        self.HISTORY_FILE = os.path.join(self.CONFIG_DIR, "node_history.json")
         self.LOG_FILE = os.path.join(self.LOG_DIR, "v2ray_command.log")
 
 CONFIG = Config()
@@ -119,6 +136,36 @@ BUILTIN_NODES = [
 
 DEFAULT_UUID = "39a279a5-55bb-3a27-ad9b-6ec81ff5779a"
 
+# ==================== Proxy Modes ====================
+PROXY_MODES = ["direct", "chained", "balanced"]
+PROXY_MODE_NAMES = {
+    "direct": "Level-1 Proxy (Direct)",
+    "chained": "Level-2 Proxy (Chained)",
+    "balanced": "Load-Balanced Proxy (Balanced)"
+}
+
+# Direct/chained mode route all traffic to the PROXY_TAG outbound (the node, or the
+# static proxy that dials through the CHAINED_NODE_TAG node), so switching nodes or
+# toggling between the two modes only swaps outbounds (see hot_swap_outbounds)
+PROXY_TAG = "proxy"
+CHAINED_NODE_TAG = "proxy-node"
+
+# V2Ray API inbound, used to swap outbounds without restarting the service
+API_TAG = "api"
+API_LISTEN = "127.0.0.1"
+API_PORT = 10085
+API_TIMEOUT = 5
+API_STAGING_SUFFIX = "-staged"  # Tag suffix a changed outbound is validated under before the swap
+
+# Balanced mode: N tagged node outbounds behind a V2Ray routing balancer
+BALANCER_TAG = "node-balancer"
+BALANCER_OUTBOUND_PREFIX = "balance-node-"
+BALANCER_STRATEGIES = ["random", "leastPing"]
+BALANCER_DEFAULTS = {"count": 4, "strategy": "leastPing"}
+BALANCER_MIN_NODES = 2  # Fewer would generate the direct layout
+OBSERVATORY_PROBE_URL = "https://www.google.com/generate_204"
+OBSERVATORY_PROBE_INTERVAL = "30s"
+
 # ==================== Static Proxy Configuration ====================
 def get_static_proxy_config():
     """Load static proxy configuration from subscription_url.ini"""
@@ -191,6 +238,220 @@ def run_command(command, capture_output=True, check=True):
             raise
         return None
 
+# ==================== State Files ====================
+_STATE_CACHE = {}  # path -> (mtime_ns, size, parsed object)
+
+def read_json_state(path):
+    """Parsed JSON state file, or None when it doesn't exist
+
+    Each file is parsed once and served from memory until its mtime or
+    size changes, so edits by other processes (the monitor service, a
+    second shell) are still seen. The returned object is shared: treat it
+    as read-only, or write it back with write_json_state after changing it.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        _STATE_CACHE.pop(path, None)
+        return None
+
+    entry = _STATE_CACHE.get(path)
+    if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+        return entry[2]
+
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    _STATE_CACHE[path] = (stat.st_mtime_ns, stat.st_size, data)
+    return data
+
+def write_json_state(path, data, compact=False):
+    """Atomically write a JSON state file and cache the written object"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_file = f"{path}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            if compact:
+                json.dump(data, f, separators=(',', ':'), ensure_ascii=False)
+            else:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(temp_file, path)
+    except Exception:
+        # The caller may have changed the cached object in place
+        _STATE_CACHE.pop(path, None)
+        raise
+    stat = os.stat(path)
+    _STATE_CACHE[path] = (stat.st_mtime_ns, stat.st_size, data)
+
+# ==================== Node Store ====================
+# Nodes, subscription sources, settings and probe history live in one SQLite
+# database, so callers query or update just the rows they need instead of
+# rewriting a whole JSON document.
+NODE_STORE_VERSION = 1
+NODE_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    identity TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    name TEXT,
+    region TEXT,
+    protocol TEXT,
+    server TEXT,
+    port INTEGER,
+    source TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS nodes_position ON nodes (position);
+CREATE INDEX IF NOT EXISTS nodes_region ON nodes (region);
+CREATE INDEX IF NOT EXISTS nodes_protocol ON nodes (protocol);
+CREATE INDEX IF NOT EXISTS nodes_endpoint ON nodes (server, port);
+CREATE TABLE IF NOT EXISTS sources (
+    position INTEGER PRIMARY KEY,
+    name TEXT,
+    url TEXT,
+    status TEXT,
+    nodes INTEGER
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS probe_results (
+    identity TEXT PRIMARY KEY,
+    latency REAL,
+    success REAL,
+    family TEXT,
+    address TEXT,
+    samples TEXT NOT NULL,
+    updated INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS probe_results_updated ON probe_results (updated);
+"""
+_NODE_STORES = {}  # path -> sqlite3.Connection
+_NODE_STORE_LOCK = threading.RLock()
+
+def get_node_store():
+    """Open the node store (once per process and path), creating or migrating it"""
+    path = CONFIG.NODE_STORE_FILE
+    with _NODE_STORE_LOCK:
+        db = _NODE_STORES.get(path)
+        if db is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            if db.execute("PRAGMA user_version").fetchone()[0] < NODE_STORE_VERSION:
+                db.executescript(NODE_STORE_SCHEMA)
+                migrate_json_state(db)
+                db.execute(f"PRAGMA user_version = {NODE_STORE_VERSION}")
+            _NODE_STORES[path] = db
+        return db
+
+def close_node_store():
+    """Close the node store connection (before replacing the database file)"""
+    with _NODE_STORE_LOCK:
+        db = _NODE_STORES.pop(CONFIG.NODE_STORE_FILE, None)
+        if db is not None:
+            db.close()
+
+def _node_row(node, position):
+    return (node_identity(node), position, node.get("name"), node.get("region"),
+            node.get("protocol", "vmess"), node.get("server"), node.get("port"),
+            node.get("source"), json.dumps(dict(node), ensure_ascii=False))
+
+def _history_row(key, entry):
+    return (key, entry.get("latency"), entry.get("success"), entry.get("family"), entry.get("address"),
+            json.dumps(entry["samples"]), entry["samples"][-1][0] if entry["samples"] else 0)
+
+def migrate_json_state(db):
+    """One-time import of subscription.json and node_history.json
+
+    The imported files are renamed to *.migrated so they stay around as a
+    backup but are never imported twice.
+    """
+    subscription = history = None
+    try:
+        subscription = read_json_state(CONFIG.SUBSCRIPTION_FILE)
+        history = read_json_state(CONFIG.HISTORY_FILE)
+    except Exception as e:
+        log(f"Failed to read JSON state for migration: {str(e)}", "WARNING")
+    if subscription is None and history is None:
+        return
+
+    with db:
+        if subscription:
+            nodes = {}
+            for node in subscription.get("nodes", []):
+                nodes.setdefault(node_identity(node), Node.from_dict(node))
+            db.executemany("INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           [_node_row(node, i) for i, node in enumerate(nodes.values())])
+            sources = subscription.get("sources") or [{"name": "default", "url": subscription.get("url")}]
+            db.executemany("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?)",
+                           [(i, s.get("name"), s.get("url"), s.get("status"), s.get("nodes"))
+                            for i, s in enumerate(sources)])
+            settings = {key: value for key, value in subscription.items() if key not in ("nodes", "sources")}
+            db.executemany("INSERT OR REPLACE INTO settings VALUES (?, ?)",
+                           [(key, json.dumps(value, ensure_ascii=False)) for key, value in settings.items()])
+        if history:
+            db.executemany("INSERT OR REPLACE INTO probe_results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           [_history_row(key, entry) for key, entry in history.items()])
+
+    for path in (CONFIG.SUBSCRIPTION_FILE, CONFIG.HISTORY_FILE):
+        if os.path.exists(path):
+            os.replace(path, f"{path}.migrated")
+    log(f"Migrated {len((subscription or {}).get('nodes', []))} nodes and "
+        f"{len(history or {})} history entries to {CONFIG.NODE_STORE_FILE}", "INFO")
+
+def get_setting(key, default=None):
+    """Read one setting (proxy_mode, static_proxy, balancer, ...)"""
+    with _NODE_STORE_LOCK:
+        row = get_node_store().execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+    return json.loads(row[0]) if row else default
+
+def set_setting(key, value):
+    """Write one setting"""
+    db = get_node_store()
+    with _NODE_STORE_LOCK, db:
+        db.execute("INSERT OR REPLACE INTO settings VALUES (?, ?)", (key, json.dumps(value, ensure_ascii=False)))
+
+def query_nodes(where="", params=()):
+    """Stored nodes matching an optional SQL condition, in subscription order"""
+    sql = f"SELECT data FROM nodes {'WHERE ' + where if where else ''} ORDER BY position"
+    with _NODE_STORE_LOCK:
+        rows = get_node_store().execute(sql, params).fetchall()
+    return [Node.from_dict(json.loads(row[0])) for row in rows]
+
+def get_node(identity):
+    """Stored node with the given node_identity (primary key lookup), or None"""
+    nodes = query_nodes("identity = ?", (identity,))
+    return nodes[0] if nodes else None
+
+def count_nodes():
+    """Number of stored subscription nodes"""
+    with _NODE_STORE_LOCK:
+        return get_node_store().execute("SELECT COUNT(*) FROM nodes").fetchone()[0]
+
+def get_sources():
+    """Per-source summary of the stored subscription (see summarize_sources)"""
+    with _NODE_STORE_LOCK:
+        rows = get_node_store().execute("SELECT name, url, status, nodes FROM sources ORDER BY position").fetchall()
+    return [{"name": name, "url": url, "status": status, "nodes": nodes} for name, url, status, nodes in rows]
+
+def backup_node_store():
+    """Snapshot the node store to NODE_STORE_FILE.backup (consistent while in use)"""
+    backup = sqlite3.connect(f"{CONFIG.NODE_STORE_FILE}.backup")
+    try:
+        with _NODE_STORE_LOCK:
+            get_node_store().backup(backup)
+    finally:
+        backup.close()
+
+def restore_node_store(backup_path):
+    """Copy a snapshot back into the live node store"""
+    backup = sqlite3.connect(backup_path)
+    try:
+        with _NODE_STORE_LOCK:
+            backup.backup(get_node_store())
+    finally:
+        backup.close()
+
 # ==================== Platform Abstraction ====================
 class PlatformHandler(abc.ABC):
     """Abstract base class for platform-specific operations"""
@@ -239,6 +500,14 @@ class PlatformHandler(abc.ABC):
     def configure_proxychains(self):
         """Configure ProxyChains"""
         pass
+    @abc.abstractmethod
+    def create_monitor_service(self, monitor_args=()):
+        """Create and start the node health monitor service
+
+        monitor_args are extra "monitor" command line options (see
+        monitor_cli_args) baked into the service command.
+        """
+        pass
 
 class MacOSHandler(PlatformHandler):
     """macOS-specific implementations"""
@@ -334,7 +603,7 @@ class MacOSHandler(PlatformHandler):
         
         try:
             log("Downloading V2Ray...", "INFO")
-            run_command(f"curl -L -o {zip_file} {download_url}", capture_output=False)
+            http_download(download_url, zip_file)
             
             # Extract files
             log("Extracting V2Ray files...", "INFO")
@@ -510,6 +779,53 @@ socks5 127.0.0.1 20808
             except Exception as e:
                 log(f"Failed to update proxychains-ng config: {str(e)}", "WARNING")
 
+    def create_monitor_service(self, monitor_args=()):
+        """Create launchd service for the node health monitor on macOS"""
+        label = f"{CONFIG.SERVICE_NAME}.monitor"
+        plist_path = f"/Library/LaunchDaemons/{label}.plist"
+        script_path = os.path.abspath(__file__)
+        # One <string> per argument, so paths with spaces need no quoting, only XML escaping
+        program_args = "\n".join(f"        <string>{xml_escape(arg)}</string>"
+                                 for arg in [sys.executable, script_path, "monitor", *monitor_args])
+
+        plist_content = f"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
+<plist version="1.0">
+<dict>
+    <key>Label</key>
+    <string>{label}</string>
+    <key>ProgramArguments</key>
+    <array>
+{program_args}
+    </array>
+    <key>RunAtLoad</key>
+    <true/>
+    <key>KeepAlive</key>
+    <true/>
+    <key>StandardErrorPath</key>
+    <string>{CONFIG.LOG_FILE}.monitor.error</string>
+    <key>StandardOutPath</key>
+    <string>{CONFIG.LOG_FILE}.monitor.out</string>
+</dict>
+</plist>"""
+
+        try:
+            with tempfile.NamedTemporaryFile(mode='w', suffix='.plist', delete=False) as f:
+                f.write(plist_content)
+                temp_plist = f.name
+
+            run_command(f"sudo cp {temp_plist} {plist_path}")
+            run_command(f"sudo chown root:wheel {plist_path}")
+            run_command(f"sudo chmod 644 {plist_path}")
+            os.unlink(temp_plist)
+            run_command(f"sudo launchctl load -w {plist_path}", check=False)
+
+            log("Node monitor launchd service created", "SUCCESS")
+            return True
+        except Exception as e:
+            log(f"Failed to create monitor service: {str(e)}", "ERROR")
+            return False
+
 class LinuxHandler(PlatformHandler):
     """Linux-specific implementations"""
     
@@ -609,8 +925,13 @@ class LinuxHandler(PlatformHandler):
         # Online installation
         log("Downloading V2Ray installation script...", "INFO")
         install_script = "/tmp/install-release.sh"
-        run_command(f"wget -O {install_script} https://raw.githubusercontent.com/v2fly/fhs-install-v2ray/master/install-release.sh")
-        run_command(f"chmod +x {install_script}")
+        try:
+            http_download("https://raw.githubusercontent.com/v2fly/fhs-install-v2ray/master/install-release.sh",
+                          install_script)
+        except Exception as e:
+            log(f"Failed to download installation script: {str(e)}", "ERROR")
+            return False
+        os.chmod(install_script, 0o755)
         
         # Execute installation
         log("Installing V2Ray...", "INFO")
@@ -747,6 +1068,34 @@ WantedBy=multi-user.target
             
             log("ProxyChains4 configuration completed", "SUCCESS")
 
+    def create_monitor_service(self, monitor_args=()):
+        """Create systemd service for the node health monitor on Linux"""
+        command = shlex.join([sys.executable, os.path.abspath(__file__), "monitor", *monitor_args])
+        service_content = f"""[Unit]
+Description=V2Ray Node Health Monitor
+After=network.target v2ray.service
+Wants=v2ray.service
+
+[Service]
+ExecStart={command}
+Restart=on-failure
+RestartSec=10
+
+[Install]
+WantedBy=multi-user.target
+"""
+        try:
+            with open("/etc/systemd/system/v2ray-monitor.service", "w") as f:
+                f.write(service_content)
+
+            run_command("systemctl daemon-reload")
+            run_command("systemctl enable --now v2ray-monitor", check=False)
+            log("Node monitor systemd service created", "SUCCESS")
+            return True
+        except Exception as e:
+            log(f"Failed to create monitor service: {str(e)}", "ERROR")
+            return False
+
 # ==================== Platform Handler Factory ====================
 def get_platform_handler():
     """Get the appropriate platform handler"""
@@ -771,6 +1120,109 @@ def get_platform_handler():
 # Global platform handler
 PLATFORM_HANDLER = get_platform_handler()
 
+# ==================== Node Model ====================
+class Node(collections.abc.Mapping):
+    """A proxy node
+
+    Nodes are slotted records that read like the dicts they replace
+    (node["server"], node.get("sni"), {**node, ...}); a field that was
+    never set is absent. Treat them as immutable and use replace() to
+    derive a changed node. The share link the node was parsed from isn't
+    kept.
+    """
+    FIELDS = ("protocol", "name", "server", "port", "uuid", "password", "method", "alterId",
+              "network", "tls", "sni", "type", "host", "path", "security", "alpn", "flow",
+              "allow_insecure", "plugin", "plugin_opts", "region", "source", "family")
+    __slots__ = FIELDS + ("_identity",)
+
+    def __init__(self, **fields):
+        for key, value in fields.items():
+            setattr(self, key, value)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Node from a dict; unknown keys (probe results, a stored "original" link) are dropped"""
+        return cls(**{key: value for key, value in data.items() if key in NODE_FIELDS})
+
+    @classmethod
+    def from_outbound(cls, outbound, name="Current Node"):
+        """Node rebuilt from a V2Ray outbound (the inverse of build_node_outbound)"""
+        server = outbound_server(outbound) or {}
+        user = (server.get("users") or [{}])[0]
+        stream = outbound.get("streamSettings", {})
+        fields = {
+            "protocol": outbound.get("protocol", "vmess"),
+            "name": name,
+            "server": server.get("address"),
+            "port": server.get("port"),
+            "network": stream.get("network", "tcp"),
+            "tls": stream.get("security", "")
+        }
+        for key, value in [("uuid", user.get("id")), ("alterId", user.get("alterId")),
+                           ("security", user.get("security")), ("flow", user.get("flow")),
+                           ("password", server.get("password")), ("method", server.get("method"))]:
+            if value is not None:
+                fields[key] = value
+        if "tlsSettings" in stream:
+            fields["sni"] = stream["tlsSettings"].get("serverName", "")
+            fields["allow_insecure"] = stream["tlsSettings"].get("allowInsecure", False)
+        if "wsSettings" in stream:
+            fields["path"] = stream["wsSettings"].get("path", "/")
+            fields["host"] = stream["wsSettings"].get("headers", {}).get("Host", "")
+        return cls(**fields)
+
+    def __getitem__(self, key):
+        if key in NODE_FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in NODE_FIELDS else default
+
+    def __contains__(self, key):
+        return key in NODE_FIELDS and hasattr(self, key)
+
+    def __iter__(self):
+        return (key for key in self.FIELDS if hasattr(self, key))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"Node({dict(self)!r})"
+
+    def replace(self, **changes):
+        """Copy of the node with some fields changed"""
+        return Node(**{**self, **changes})
+
+    @property
+    def identity(self):
+        """node_identity of this node (computed once)"""
+        try:
+            return self._identity
+        except AttributeError:
+            self._identity = _identity_key(self)
+            return self._identity
+
+NODE_FIELDS = frozenset(Node.FIELDS)
+
+def as_node(node):
+    """Node for a node or node-like dict"""
+    return node if isinstance(node, Node) else Node.from_dict(node)
+
+def _identity_key(node):
+    credential = node.get('uuid') or node.get('password') or DEFAULT_UUID
+    return f"{node.get('protocol', 'vmess')}|{node.get('server')}|{node.get('port')}|{credential}"
+
+def node_identity(node):
+    """Stable identity key for a node (protocol, endpoint and credentials)"""
+    if isinstance(node, Node):
+        return node.identity
+    return _identity_key(node)
+
 # ==================== Core Functions (Platform-independent) ====================
 
 def check_system():
@@ -791,27 +1243,24 @@ def parse_vmess(vmess_url):
         vmess_data = vmess_url.replace('vmess://', '')
         node_info = json.loads(base64.b64decode(vmess_data).decode('utf-8'))
 
-        node = {
-            "protocol": "vmess",
-            "name": node_info.get("ps", "Unknown"),
-            "server": node_info.get("add"),
-            "port": int(node_info.get("port", 443)),
-            "uuid": node_info.get("id"),
-            "alterId": int(node_info.get("aid", 0)),
-            "network": node_info.get("net", "tcp"),
-            "tls": node_info.get("tls", ""),
-            "sni": node_info.get("sni", node_info.get("add")),
-            "type": node_info.get("type", "none"),
-            "host": node_info.get("host", ""),
-            "path": node_info.get("path", ""),
-            "security": node_info.get("scy", "auto"),
-            "alpn": node_info.get("alpn", ""),
-            "original": vmess_url
-        }
-
-        # Infer region
-        node["region"] = infer_region(node["name"])
-        return node
+        name = node_info.get("ps", "Unknown")
+        return Node(
+            protocol="vmess",
+            name=name,
+            server=node_info.get("add"),
+            port=int(node_info.get("port", 443)),
+            uuid=node_info.get("id"),
+            alterId=int(node_info.get("aid", 0)),
+            network=node_info.get("net", "tcp"),
+            tls=node_info.get("tls", ""),
+            sni=node_info.get("sni", node_info.get("add")),
+            type=node_info.get("type", "none"),
+            host=node_info.get("host", ""),
+            path=node_info.get("path", ""),
+            security=node_info.get("scy", "auto"),
+            alpn=node_info.get("alpn", ""),
+            region=infer_region(name)
+        )
     except Exception as e:
         log(f"Failed to parse VMess node: {str(e)}", "WARNING")
         return None
@@ -822,87 +1271,422 @@ def parse_vless(vless_url):
         parsed = urlparse(vless_url)
         params = parse_qs(parsed.query)
 
-        node = {
-            "protocol": "vless",
-            "name": unquote(parsed.fragment) if parsed.fragment else "Unknown",
-            "server": parsed.hostname,
-            "port": parsed.port or 443,
-            "uuid": parsed.username,
-            "network": params.get("type", ["tcp"])[0],
-            "tls": params.get("security", [""])[0],
-            "sni": params.get("sni", [parsed.hostname])[0],
-            "flow": params.get("flow", [""])[0],
-            "host": params.get("host", [""])[0],
-            "path": params.get("path", ["/"])[0],
-            "alpn": params.get("alpn", [""])[0],
-            "original": vless_url
+        name = unquote(parsed.fragment) if parsed.fragment else "Unknown"
+        return Node(
+            protocol="vless",
+            name=name,
+            server=parsed.hostname,
+            port=parsed.port or 443,
+            uuid=parsed.username,
+            network=params.get("type", ["tcp"])[0],
+            tls=params.get("security", [""])[0],
+            sni=params.get("sni", [parsed.hostname])[0],
+            flow=params.get("flow", [""])[0],
+            host=params.get("host", [""])[0],
+            path=params.get("path", ["/"])[0],
+            alpn=params.get("alpn", [""])[0],
+            region=infer_region(name)
+        )
+    except Exception as e:
+        log(f"Failed to parse VLESS node: {str(e)}", "WARNING")
+        return None
+
+def parse_trojan(trojan_url):
+    """Parse Trojan URL (trojan://password@host:port?params#name)"""
+    try:
+        parsed = urlparse(trojan_url)
+        params = parse_qs(parsed.query)
+        security = params.get("security", ["tls"])[0]
+
+        name = unquote(parsed.fragment) if parsed.fragment else "Unknown"
+        return Node(
+            protocol="trojan",
+            name=name,
+            server=parsed.hostname,
+            port=parsed.port or 443,
+            password=unquote(parsed.netloc.rpartition('@')[0]),
+            network=params.get("type", ["tcp"])[0],
+            tls="" if security == "none" else security,
+            sni=params.get("sni", params.get("peer", [parsed.hostname]))[0],
+            host=params.get("host", [""])[0],
+            path=params.get("path", ["/"])[0],
+            alpn=params.get("alpn", [""])[0],
+            allow_insecure=params.get("allowInsecure", ["0"])[0].lower() in ["1", "true"],
+            region=infer_region(name)
+        )
+    except Exception as e:
+        log(f"Failed to parse Trojan node: {str(e)}", "WARNING")
+        return None
+
+def _decode_base64(data):
+    """Decode standard or URL-safe base64, with or without padding"""
+    data = data.strip().replace('-', '+').replace('_', '/')
+    return base64.b64decode(data + '=' * (-len(data) % 4)).decode('utf-8')
+
+# Ciphers the v2fly shadowsocks outbound accepts (no 2022-blake3-* or stream ciphers)
+SHADOWSOCKS_METHODS = ["aes-128-gcm", "aes-256-gcm", "chacha20-poly1305", "chacha20-ietf-poly1305", "none", "plain"]
+
+def parse_shadowsocks(ss_url):
+    """Parse Shadowsocks URL
+
+    Supports SIP002 (ss://base64(method:password)@host:port/?plugin=...#name,
+    also with plain percent-encoded userinfo) and the legacy
+    ss://base64(method:password@host:port)#name form. The v2ray-plugin
+    websocket/TLS options map onto V2Ray stream settings. Nodes using other
+    SIP003 plugins or ciphers outside SHADOWSOCKS_METHODS can't be expressed
+    in a V2Ray config and are skipped.
+    """
+    try:
+        body, _, fragment = ss_url[len('ss://'):].partition('#')
+        main, _, query = body.partition('?')
+        main = main.rstrip('/')
+        if '@' not in main:
+            main = _decode_base64(main)
+
+        userinfo, _, hostport = main.rpartition('@')
+        userinfo = unquote(userinfo)
+        if ':' not in userinfo:
+            userinfo = _decode_base64(userinfo)
+        method, _, password = userinfo.partition(':')
+        endpoint = urlparse(f"//{hostport}")
+
+        fields = {
+            "protocol": "shadowsocks",
+            "name": unquote(fragment) if fragment else "Unknown",
+            "server": endpoint.hostname,
+            "port": endpoint.port,
+            "method": method,
+            "password": password,
+            "network": "tcp",
+            "tls": ""
         }
 
-        # Infer region
-        node["region"] = infer_region(node["name"])
-        return node
+        if method.lower() not in SHADOWSOCKS_METHODS:
+            log(f"Shadowsocks cipher {method} is not supported by V2Ray, skipping {fields['name']}", "WARNING")
+            return None
+
+        # SIP003 plugin: "name;opt1;key=value;..."
+        plugin = parse_qs(query).get("plugin", [""])[0]
+        if plugin:
+            plugin_name, *plugin_args = plugin.split(';')
+            opts = dict(arg.partition('=')[::2] for arg in plugin_args if arg)
+            if plugin_name != "v2ray-plugin" or opts.get("mode", "websocket") != "websocket":
+                log(f"Shadowsocks plugin {plugin_name} is not supported by V2Ray, skipping {fields['name']}", "WARNING")
+                return None
+            fields.update({
+                "plugin": plugin_name,
+                "plugin_opts": ';'.join(plugin_args),
+                "network": "ws",
+                "tls": "tls" if "tls" in opts else "",
+                "host": opts.get("host", ""),
+                "path": opts.get("path", "/"),
+                "sni": opts.get("host") or endpoint.hostname
+            })
+
+        return Node(**fields, region=infer_region(fields["name"]))
     except Exception as e:
-        log(f"Failed to parse VLESS node: {str(e)}", "WARNING")
+        log(f"Failed to parse Shadowsocks node: {str(e)}", "WARNING")
         return None
 
+# ==================== Region Inference ====================
+# Region -> ISO 3166 alpha-2/alpha-3 codes; alpha-2 also maps flag emoji
+REGION_ISO_CODES = {
+    "Hong Kong": ["HK", "HKG"],
+    "Japan": ["JP", "JPN"],
+    "Singapore": ["SG", "SGP"],
+    "USA": ["US", "USA"],
+    "Korea": ["KR", "KOR"],
+    "Taiwan": ["TW", "TWN"],
+    "Canada": ["CA", "CAN"],
+    "UK": ["GB", "GBR", "UK"],
+    "Germany": ["DE", "DEU"],
+    "India": ["IN", "IND"],
+    "Russia": ["RU", "RUS"]
+}
+
+# Region -> name keywords; latin keywords match whole words only, CJK ones anywhere.
+# Extend or override with a [region_keywords] section in subscription_url.ini,
+# e.g. "Japan = osaka, 大阪"
+REGION_KEYWORDS = {
+    "Hong Kong": ["hong kong", "hongkong", "xianggang", "香港"],
+    "Japan": ["japan", "tokyo", "osaka", "riben", "日本", "东京", "大阪"],
+    "Singapore": ["singapore", "xinjiapo", "新加坡", "狮城"],
+    "USA": ["united states", "america", "los angeles", "san jose", "seattle", "silicon valley",
+            "meiguo", "美国", "洛杉矶", "硅谷"],
+    "Korea": ["korea", "seoul", "hanguo", "韩国", "首尔"],
+    "Taiwan": ["taiwan", "taipei", "台湾", "台北"],
+    "Canada": ["canada", "toronto", "vancouver", "jianada", "加拿大"],
+    "UK": ["britain", "england", "united kingdom", "london", "yingguo", "英国", "伦敦"],
+    "Germany": ["germany", "frankfurt", "deguo", "德国", "法兰克福"],
+    "India": ["india", "mumbai", "yindu", "印度", "孟买"],
+    "Russia": ["russia", "moscow", "eluosi", "俄罗斯", "莫斯科"]
+}
+
+_FLAG_PATTERN = re.compile("[\U0001F1E6-\U0001F1FF]{2}")
+_KEYWORD_SEPARATORS = re.compile(r"[\s_\-]+")
+
+def load_region_keywords():
+    """Built-in keyword table merged with [region_keywords] from subscription_url.ini"""
+    keywords = {region: list(words) for region, words in REGION_KEYWORDS.items()}
+    ini_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "subscription_url.ini")
+    if not os.path.exists(ini_path):
+        return keywords
+
+    try:
+        config = configparser.ConfigParser()
+        config.optionxform = str  # Keep region names as written
+        config.read(ini_path, encoding='utf-8')
+        if config.has_section('region_keywords'):
+            for region, value in config.items('region_keywords'):
+                words = [w.strip() for w in value.split(',') if w.strip()]
+                keywords.setdefault(region, []).extend(words)
+    except Exception as e:
+        log(f"Failed to load region keywords: {str(e)}", "WARNING")
+
+    return keywords
+
+@functools.lru_cache(maxsize=None)
+def _region_matcher():
+    """Compile the keyword table into one regex plus lookup tables (built once)
+
+    Returns (keyword pattern, ISO code pattern, keyword/code -> region,
+    flag emoji -> region). Latin keywords match as whole words in any case.
+    ISO codes are short enough to be ordinary words ("in", "ca"), so they
+    only match when written in uppercase ("HK") or glued to a digit, "-"
+    or "_" ("hk01", "jp-2").
+    """
+    keywords = load_region_keywords()
+    lookup = {}
+    for region, codes in REGION_ISO_CODES.items():
+        for code in codes:
+            lookup.setdefault(code.lower(), region)
+    for region, words in keywords.items():
+        for word in words:
+            lookup.setdefault(_KEYWORD_SEPARATORS.sub("", word.lower()), region)
+
+    alternatives = []
+    for region, words in keywords.items():
+        for word in words:
+            parts = [re.escape(part) for part in _KEYWORD_SEPARATORS.split(word.lower()) if part]
+            if not parts:
+                continue
+            body = r"[\s_\-]*".join(parts)
+            if word.isascii():
+                body = rf"(?<![a-z]){body}(?![a-z])"
+            alternatives.append((len(word), body))
+    # Longest keywords first so "hong kong" wins over shorter overlaps
+    alternatives.sort(key=lambda item: -item[0])
+    pattern = re.compile("|".join(body for _, body in alternatives), re.IGNORECASE)
+
+    codes = sorted({code for codes in REGION_ISO_CODES.values() for code in codes}, key=lambda c: -len(c))
+    upper = "|".join(codes)
+    lower = "|".join(code.lower() for code in codes)
+    code_pattern = re.compile(
+        rf"(?<![A-Za-z])(?:{upper})(?![A-Za-z])"
+        rf"|(?<![A-Za-z])(?i:{lower})(?=[\d_\-])"
+        rf"|(?<=[\d_\-])(?i:{lower})(?![A-Za-z])"
+    )
+
+    flags = {}
+    for region, codes in REGION_ISO_CODES.items():
+        code = codes[0]
+        flags.setdefault("".join(chr(0x1F1E6 + ord(c) - ord("A")) for c in code), region)
+    return pattern, code_pattern, lookup, flags
+
+@functools.lru_cache(maxsize=16384)
 def infer_region(name):
-    """Infer region from node name"""
-    name_lower = name.lower()
-
-    region_keywords = {
-        "Hong Kong": ["hk", "hong kong", "hongkong", "xianggang"],
-        "Japan": ["jp", "japan", "tokyo", "riben"],
-        "Singapore": ["sg", "singapore", "xinjiapo"],
-        "USA": ["us", "america", "usa", "meiguo"],
-        "Korea": ["kr", "korea", "seoul", "hanguo"],
-        "Taiwan": ["tw", "taiwan", "taiw"],
-        "Canada": ["ca", "canada", "jianada"],
-        "UK": ["uk", "britain", "london", "yingguo"],
-        "Germany": ["de", "germany", "frankfurt", "deguo"],
-        "India": ["in", "india", "mumbai", "yindu"],
-        "Russia": ["ru", "russia", "moscow", "eluosi"]
-    }
+    """Infer region from node name
 
-    for region, keywords in region_keywords.items():
-        if any(keyword in name_lower for keyword in keywords):
-            return region
+    A flag emoji wins, then the earliest keyword, and only then the
+    earliest ISO code, so "Server in Tokyo" is Japan rather than India.
+    Results are memoized per name.
+    """
+    pattern, code_pattern, lookup, flags = _region_matcher()
+
+    for flag in _FLAG_PATTERN.findall(name):
+        if flag in flags:
+            return flags[flag]
+
+    match = pattern.search(name) or code_pattern.search(name)
+    if match:
+        return lookup.get(_KEYWORD_SEPARATORS.sub("", match.group(0).lower()), "Other")
 
     return "Other"
 
-def parse_subscription(url):
-    """Parse subscription content"""
-    log(f"Fetching subscription content: {url}", "INFO")
+# ==================== HTTP Client ====================
+HTTP_POOL_SIZE = 16          # Keep-alive connections per host
+HTTP_RETRIES = 2             # Retries on connect errors and 429/5xx responses
+HTTP_BACKOFF = 0.5           # Retry backoff factor (0.5s, 1s, ...)
+HTTP_TIMEOUT = 10
+LOCAL_PROXIES = {
+    "socks": "socks5h://127.0.0.1:20808",
+    "http": "http://127.0.0.1:20809"
+}
+IP_INFO_URL = "https://ipinfo.io"
+
+_HTTP_SESSIONS = {}
+_HTTP_SESSIONS_LOCK = threading.Lock()
+
+def socks_supported():
+    """requests needs PySocks (pip install requests[socks]) for SOCKS proxies"""
+    try:
+        import socks  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def get_http_session(proxy=None):
+    """Shared keep-alive session for a route, created on first use
+
+    Args:
+        proxy: None for direct requests (honouring proxy environment variables),
+            or "socks"/"http" to go through the local V2Ray inbound
+    """
+    with _HTTP_SESSIONS_LOCK:
+        session = _HTTP_SESSIONS.get(proxy)
+        if session is None:
+            session = requests.Session()
+            retry = Retry(total=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF,
+                          status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET", "HEAD"])
+            adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE,
+                                                    max_retries=retry)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            if proxy:
+                session.trust_env = False
+                session.proxies = {"http": LOCAL_PROXIES[proxy], "https": LOCAL_PROXIES[proxy]}
+            _HTTP_SESSIONS[proxy] = session
+        return session
+
+def http_get(url, proxy=None, timeout=HTTP_TIMEOUT, **kwargs):
+    """GET through the shared session of a route (see get_http_session)"""
+    return get_http_session(proxy).get(url, timeout=timeout, **kwargs)
+
+def http_download(url, path, timeout=60, proxy=None):
+    """Stream a URL to a file"""
+    with http_get(url, proxy=proxy, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        with open(path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=65536):
+                f.write(chunk)
+
+# ==================== Subscription Cache ====================
+SUBSCRIPTION_TIMEOUT = 30      # Seconds to wait for the subscription provider (per source, "timeout=" in the ini)
+REVALIDATE_WAIT = 5            # Seconds quick_start waits for a background revalidation to finish
+_SUBSCRIPTION_CACHE_LOCK = threading.Lock()  # Serializes concurrent cache updates
 
+def load_subscription_cache():
+    """Load cached subscription bodies and their validators, keyed by URL"""
     try:
-        # Get subscription content
-        response = requests.get(url, timeout=30)
+        if os.path.exists(CONFIG.SUBSCRIPTION_CACHE_FILE):
+            with open(CONFIG.SUBSCRIPTION_CACHE_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+    except Exception as e:
+        log(f"Failed to load subscription cache: {str(e)}", "WARNING")
+    return {}
+
+def save_subscription_cache(url, entry):
+    """Atomically store one URL's cached body and validators"""
+    try:
+        with _SUBSCRIPTION_CACHE_LOCK:
+            cache = load_subscription_cache()
+            cache[url] = entry
+            os.makedirs(CONFIG.CONFIG_DIR, exist_ok=True)
+            temp_file = f"{CONFIG.SUBSCRIPTION_CACHE_FILE}.tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, ensure_ascii=False)
+            os.replace(temp_file, CONFIG.SUBSCRIPTION_CACHE_FILE)
+    except Exception as e:
+        log(f"Failed to save subscription cache: {str(e)}", "WARNING")
+
+def fetch_subscription(url, timeout=SUBSCRIPTION_TIMEOUT):
+    """Conditionally fetch a subscription body
+
+    Sends If-None-Match / If-Modified-Since from the cached response, so an
+    unchanged subscription costs one empty 304 round trip. Requests go
+    through the shared direct session of the HTTP client.
+
+    Returns:
+        (status, body): status is "modified" (new body, now cached),
+        "not_modified" (304, body is the cached copy) or "error" (body None)
+    """
+    cached = load_subscription_cache().get(url)
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    try:
+        response = http_get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and cached:
+            save_subscription_cache(url, {**cached, "fetched_at": int(time.time())})
+            return "not_modified", cached["body"]
         response.raise_for_status()
-        content = response.text.strip()
+    except Exception as e:
+        log(f"Failed to fetch subscription {url}: {str(e)}", "ERROR")
+        return "error", None
+
+    body = response.text.strip()
+    save_subscription_cache(url, {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "fetched_at": int(time.time()),
+        "body": body
+    })
+    return "modified", body
+
+def parse_subscription_content(content):
+    """Parse nodes from a (usually base64 encoded) subscription body"""
+    # Base64 decode
+    try:
+        decoded = base64.b64decode(content).decode('utf-8')
+    except:
+        decoded = content
 
-        # Base64 decode
-        try:
-            decoded = base64.b64decode(content).decode('utf-8')
-        except:
-            decoded = content
+    # Parse nodes
+    nodes = []
+    for line in decoded.strip().split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith('vmess://'):
+            node = parse_vmess(line)
+            if node:
+                nodes.append(node)
+        elif line.startswith('vless://'):
+            node = parse_vless(line)
+            if node:
+                nodes.append(node)
+        elif line.startswith('trojan://'):
+            node = parse_trojan(line)
+            if node:
+                nodes.append(node)
+        elif line.startswith('ss://'):
+            node = parse_shadowsocks(line)
+            if node:
+                nodes.append(node)
 
-        # Parse nodes
-        nodes = []
-        for line in decoded.strip().split('\n'):
-            line = line.strip()
-            if not line:
-                continue
+    return nodes
+
+def parse_subscription(url, fetch_result=None):
+    """Parse subscription content
+
+    fetch_result is an optional (status, body) from fetch_subscription, so
+    callers that already fetched don't download again.
+    """
+    if fetch_result is None:
+        log(f"Fetching subscription content: {url}", "INFO")
+        fetch_result = fetch_subscription(url)
 
-            if line.startswith('vmess://'):
-                node = parse_vmess(line)
-                if node:
-                    nodes.append(node)
-            elif line.startswith('vless://'):
-                node = parse_vless(line)
-                if node:
-                    nodes.append(node)
-            elif line.startswith('ss://'):
-                log(f"Shadowsocks links not yet supported", "WARNING")
+    status, body = fetch_result
+    if body is None:
+        return []
 
+    try:
+        nodes = parse_subscription_content(body)
         log(f"Successfully parsed {len(nodes)} nodes", "SUCCESS")
         return nodes
 
@@ -910,39 +1694,135 @@ def parse_subscription(url):
         log(f"Failed to parse subscription: {str(e)}", "ERROR")
         return []
 
-def generate_v2ray_config(node, proxy_mode="direct", static_proxy_config=None):
-    """Generate V2Ray configuration
+def load_cached_subscription(url):
+    """Nodes parsed from the cached body of url, or None when nothing is cached"""
+    cached = load_subscription_cache().get(url)
+    if not cached or not cached.get("body"):
+        return None
+    try:
+        return parse_subscription_content(cached["body"]) or None
+    except Exception as e:
+        log(f"Failed to parse cached subscription: {str(e)}", "WARNING")
+        return None
 
-    Args:
-        node: V2Ray node configuration
-        proxy_mode: "direct" (Level-1 proxy) or "chained" (Level-2 proxy)
-        static_proxy_config: Static proxy configuration (for chained mode)
+def subscription_body_version(body):
+    """Fingerprint of a subscription body, stored per source by save_subscription"""
+    return hashlib.sha256(body.encode('utf-8')).hexdigest() if body is not None else None
+
+def load_stored_source_nodes(source, summary, version):
+    """Stored nodes of an unchanged source, or None when they can't be reused
+
+    summary is the source's entry from get_sources and version the
+    subscription_body_version of its current cached body. The stored rows
+    must come from that same body (a background revalidation may have
+    refreshed the cache without saving), and since the store keeps each node
+    under the first source listing it, they are only the complete list when
+    none of them went to an earlier source.
     """
-    config = {
-        "log": {
-            "loglevel": "warning"
-        },
-        "inbounds": [
-            {
-                "port": 20808,
-                "protocol": "socks",
-                "settings": {
-                    "auth": "noauth",
-                    "udp": True
-                }
-            },
-            {
-                "port": 20809,
-                "protocol": "http",
-                "settings": {}
-            }
-        ],
-        "outbounds": [],
-        "routing": {
-            "rules": []
-        }
-    }
+    if not summary or summary["name"] != source["name"]:
+        return None
+    if version is None or get_setting("source_versions", {}).get(source["url"]) != version:
+        return None
+    nodes = query_nodes("source = ?", (source["name"],))
+    return nodes if len(nodes) == summary["nodes"] else None
+
+def fetch_subscriptions(sources):
+    """Fetch every subscription source concurrently over the pooled HTTP client
+
+    Each source is a {"name", "url", "timeout"} dict (see get_subscription_sources).
+    Returns one result per source with its "status" and parsed "nodes". A
+    source answering 304 reuses its stored nodes without parsing anything.
+    A source that fails or doesn't answer within its timeout falls back to
+    its cached body with status "stale" (or "error" with no nodes), so a slow
+    or dead provider never holds back the others.
+    """
+    def fetch(source):
+        status, body = fetch_subscription(source["url"], source["timeout"])
+        version = subscription_body_version(body)
+        if status == "not_modified":
+            return status, None, version
+        nodes = []
+        if body is not None:
+            try:
+                nodes = parse_subscription_content(body)
+            except Exception as e:
+                log(f"Failed to parse subscription {source['url']}: {str(e)}", "ERROR")
+                status = "error"
+        return status, nodes, version
 
+    executor = ThreadPoolExecutor(max_workers=len(sources))
+    futures = [executor.submit(fetch, source) for source in sources]
+    # requests timeouts apply per socket operation, so also cap the total wait
+    wait_futures(futures, timeout=max(source["timeout"] for source in sources) * 2)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    stored = {summary["url"]: summary for summary in get_sources()}
+    results = []
+    for source, future in zip(sources, futures):
+        finished = future.done() and not future.cancelled() and future.exception() is None
+        status, nodes, version = future.result() if finished else ("error", [], None)
+        if status == "not_modified":
+            nodes = load_stored_source_nodes(source, stored.get(source["url"]), version)
+            if nodes is None:
+                nodes = load_cached_subscription(source["url"]) or []
+        if status == "error":
+            nodes = load_cached_subscription(source["url"]) or []
+            status = "stale" if nodes else "error"
+            version = None
+        results.append({**source, "status": status, "nodes": nodes, "version": version})
+    return results
+
+def merge_subscription_nodes(results):
+    """Merge the node lists of several sources, dropping cross-provider duplicates
+
+    Nodes are keyed on node_identity (protocol/server/port/uuid); the first
+    source listing a node keeps it. Every node records its "source" name.
+    """
+    merged = {}
+    for result in results:
+        for node in result["nodes"]:
+            merged.setdefault(node_identity(node), as_node(node).replace(source=result["name"]))
+    return list(merged.values())
+
+def summarize_sources(results):
+    """Per-source metadata stored alongside the merged nodes"""
+    return [{"name": r["name"], "url": r["url"], "status": r["status"], "nodes": len(r["nodes"]),
+             "version": r.get("version")} for r in results]
+
+def load_cached_subscriptions(sources):
+    """Merged nodes from the cached bodies of all sources, or None when nothing is cached"""
+    results = [{**source, "status": "cached", "nodes": load_cached_subscription(source["url"]) or []}
+               for source in sources]
+    return merge_subscription_nodes(results) or None
+
+def start_subscription_revalidation(sources):
+    """Stale-while-revalidate: conditionally refetch all sources on a background thread
+
+    Returns the thread; once it finishes, its "nodes" attribute holds the new
+    merged node list when any source changed (None otherwise) and "results"
+    the per-source results.
+    """
+    def revalidate():
+        results = fetch_subscriptions(sources)
+        thread.results = results
+        if any(r["status"] == "modified" for r in results):
+            thread.nodes = merge_subscription_nodes(results) or None
+
+    thread = threading.Thread(target=revalidate, daemon=True)
+    thread.nodes = None
+    thread.results = None
+    thread.start()
+    return thread
+
+# Outbound sockopt domainStrategy that pins a node to its faster address family
+FAMILY_DOMAIN_STRATEGY = {"ipv4": "UseIPv4", "ipv6": "UseIPv6"}
+
+def build_node_outbound(node):
+    """Build the V2Ray outbound for a single node (untagged)
+
+    A node carrying a "family" ("ipv4"/"ipv6", see with_preferred_family)
+    is pinned to it through streamSettings.sockopt.domainStrategy.
+    """
     # Generate outbound configuration based on protocol
     if node.get("protocol") == "vmess":
         outbound = {
@@ -988,6 +1868,39 @@ def generate_v2ray_config(node, proxy_mode="direct", static_proxy_config=None):
                 "network": node.get("network", "tcp")
             }
         }
+    elif node.get("protocol") == "trojan":
+        outbound = {
+            "protocol": "trojan",
+            "settings": {
+                "servers": [
+                    {
+                        "address": node["server"],
+                        "port": node["port"],
+                        "password": node.get("password", "")
+                    }
+                ]
+            },
+            "streamSettings": {
+                "network": node.get("network", "tcp")
+            }
+        }
+    elif node.get("protocol") == "shadowsocks":
+        outbound = {
+            "protocol": "shadowsocks",
+            "settings": {
+                "servers": [
+                    {
+                        "address": node["server"],
+                        "port": node["port"],
+                        "method": node.get("method", "aes-256-gcm"),
+                        "password": node.get("password", "")
+                    }
+                ]
+            },
+            "streamSettings": {
+                "network": node.get("network", "tcp")
+            }
+        }
     else:
         # Default vmess configuration (for built-in nodes)
         outbound = {
@@ -1016,8 +1929,8 @@ def generate_v2ray_config(node, proxy_mode="direct", static_proxy_config=None):
     if node.get("tls") in ["tls", "xtls"]:
         outbound["streamSettings"]["security"] = node.get("tls")
         outbound["streamSettings"]["tlsSettings"] = {
-            "serverName": node.get("sni", node["server"]),
-            "allowInsecure": False
+            "serverName": node.get("sni") or node["server"],
+            "allowInsecure": bool(node.get("allow_insecure", False))
         }
 
     # Network configuration
@@ -1025,23 +1938,100 @@ def generate_v2ray_config(node, proxy_mode="direct", static_proxy_config=None):
         outbound["streamSettings"]["wsSettings"] = {
             "path": node.get("path", "/"),
             "headers": {
-                "Host": node.get("host", node["server"])
+                "Host": node.get("host") or node["server"]
+            }
+        }
+
+    # Address family pinning only matters when the server is a domain name
+    if node.get("family") in FAMILY_DOMAIN_STRATEGY and not is_ip_address(node["server"]):
+        outbound["streamSettings"]["sockopt"] = {
+            "domainStrategy": FAMILY_DOMAIN_STRATEGY[node["family"]]
+        }
+
+    return outbound
+
+def outbound_server(outbound):
+    """First server entry of a node outbound ("vnext" for vmess/vless, "servers" for trojan/shadowsocks)"""
+    settings = outbound.get("settings", {})
+    servers = settings.get("vnext") or settings.get("servers") or []
+    return servers[0] if servers else None
+
+def is_ip_address(host):
+    """Check whether host is an IPv4/IPv6 literal rather than a domain name"""
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+def generate_v2ray_config(node, proxy_mode="direct", static_proxy_config=None,
+                          balancer_nodes=None, balancer_strategy=BALANCER_DEFAULTS["strategy"]):
+    """Generate V2Ray configuration
+
+    Args:
+        node: V2Ray node configuration
+        proxy_mode: "direct" (Level-1 proxy), "chained" (Level-2 proxy) or "balanced"
+        static_proxy_config: Static proxy configuration (for chained mode)
+        balancer_nodes: Additional nodes balanced with `node` (for balanced mode)
+        balancer_strategy: "random" or "leastPing" (for balanced mode)
+    """
+    config = {
+        "log": {
+            "loglevel": "warning"
+        },
+        "inbounds": [
+            {
+                "port": 20808,
+                "protocol": "socks",
+                "settings": {
+                    "auth": "noauth",
+                    "udp": True
+                }
+            },
+            {
+                "port": 20809,
+                "protocol": "http",
+                "settings": {}
+            },
+            {
+                "tag": API_TAG,
+                "listen": API_LISTEN,
+                "port": API_PORT,
+                "protocol": "dokodemo-door",
+                "settings": {
+                    "address": API_LISTEN
+                }
             }
+        ],
+        "outbounds": [],
+        "api": {
+            "tag": API_TAG,
+            "services": ["HandlerService"]
+        },
+        "routing": {
+            "rules": [{
+                "type": "field",
+                "inboundTag": [API_TAG],
+                "outboundTag": API_TAG
+            }]
         }
+    }
+
+    outbound = build_node_outbound(node)
 
     # Configure outbounds based on proxy mode
     if proxy_mode == "chained" and static_proxy_config:
         # Level-2 proxy mode: Local -> V2Ray Node -> Static IP -> Internet
         # Tag the main outbound
-        outbound["tag"] = "proxy-node"
+        outbound["tag"] = CHAINED_NODE_TAG
 
         # Create static proxy outbound
         static_outbound = {
-            "tag": "static-proxy",
+            "tag": PROXY_TAG,
             "protocol": "socks" if static_proxy_config.get("protocol") == "socks5" else "http",
             "settings": {},
             "proxySettings": {
-                "tag": "proxy-node"  # Pass through V2Ray node first
+                "tag": CHAINED_NODE_TAG  # Pass through V2Ray node first
             }
         }
 
@@ -1065,200 +2055,1558 @@ def generate_v2ray_config(node, proxy_mode="direct", static_proxy_config=None):
                 }] if static_proxy_config.get("username") else []
             }]
 
-        config["outbounds"] = [outbound, static_outbound]
+        config["outbounds"] = [outbound, static_outbound]
+
+        # Route all traffic through static proxy
+        config["routing"]["rules"].append({
+            "type": "field",
+            "network": "tcp,udp",
+            "outboundTag": PROXY_TAG
+        })
+    elif proxy_mode == "balanced" and balancer_nodes:
+        # Balanced mode: Local -> one of N V2Ray Nodes (picked by the balancer) -> Internet
+        # The primary node stays first so tools reading outbounds[0] still find it
+        config["outbounds"] = [outbound] + [build_node_outbound(n) for n in balancer_nodes]
+        for i, balanced_outbound in enumerate(config["outbounds"]):
+            balanced_outbound["tag"] = f"{BALANCER_OUTBOUND_PREFIX}{i}"
+
+        config["routing"]["balancers"] = [{
+            "tag": BALANCER_TAG,
+            "selector": [BALANCER_OUTBOUND_PREFIX],
+            "strategy": {
+                "type": balancer_strategy
+            }
+        }]
+        config["routing"]["rules"].append({
+            "type": "field",
+            "network": "tcp,udp",
+            "balancerTag": BALANCER_TAG
+        })
+
+        # leastPing needs the observatory to measure each outbound
+        if balancer_strategy == "leastPing":
+            config["observatory"] = {
+                "subjectSelector": [BALANCER_OUTBOUND_PREFIX],
+                "probeUrl": OBSERVATORY_PROBE_URL,
+                "probeInterval": OBSERVATORY_PROBE_INTERVAL
+            }
+    else:
+        # Level-1 proxy mode: Local -> V2Ray Node -> Internet
+        outbound["tag"] = PROXY_TAG
+        config["outbounds"] = [outbound]
+        config["routing"]["rules"].append({
+            "type": "field",
+            "network": "tcp,udp",
+            "outboundTag": PROXY_TAG
+        })
+
+    return config
+
+def canonical_config(config):
+    """Canonical JSON text of a config (sorted keys, no whitespace)"""
+    return json.dumps(config, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+def config_hash(config):
+    """SHA-256 of the canonical config; equal hashes mean V2Ray would behave the same"""
+    return hashlib.sha256(canonical_config(config).encode('utf-8')).hexdigest()
+
+def diff_config_sections(old, new):
+    """Sections that differ between two configs
+
+    Returns (section, tag, change) tuples, change being "added", "removed"
+    or "changed". Inbounds and outbounds are compared per tag (tag None
+    when only their order changed); other top-level sections as a whole.
+    """
+    changes = []
+    for section in list(dict.fromkeys(list(old) + list(new))):
+        if section in ("inbounds", "outbounds"):
+            old_items = {item.get("tag", str(i)): item for i, item in enumerate(old.get(section, []))}
+            new_items = {item.get("tag", str(i)): item for i, item in enumerate(new.get(section, []))}
+            tagged = []
+            for tag in list(dict.fromkeys(list(old_items) + list(new_items))):
+                if tag not in new_items:
+                    tagged.append((section, tag, "removed"))
+                elif tag not in old_items:
+                    tagged.append((section, tag, "added"))
+                elif canonical_config(old_items[tag]) != canonical_config(new_items[tag]):
+                    tagged.append((section, tag, "changed"))
+            if not tagged and list(old_items) != list(new_items):
+                tagged.append((section, None, "changed"))
+            changes.extend(tagged)
+        elif section not in new:
+            changes.append((section, None, "removed"))
+        elif section not in old:
+            changes.append((section, None, "added"))
+        elif canonical_config(old[section]) != canonical_config(new[section]):
+            changes.append((section, None, "changed"))
+    return changes
+
+def format_config_changes(changes):
+    """One-line summary of diff_config_sections output"""
+    return ", ".join(f"{section}[{tag}] {change}" if tag else f"{section} {change}"
+                     for section, tag, change in changes)
+
+# ==================== V2Ray API ====================
+class V2RayAPI:
+    """HandlerService client for a running V2Ray
+
+    The gRPC API takes V2Ray's own protobuf messages, which `v2ray api`
+    builds from JSON outbounds, so the client drives that command rather
+    than speaking gRPC itself. address may point at any API server,
+    including a local stand-in.
+    """
+    def __init__(self, address=f"{API_LISTEN}:{API_PORT}", binary=None, timeout=API_TIMEOUT):
+        self.address = address
+        self.binary = binary or CONFIG.V2RAY_BIN
+        self.timeout = timeout
+
+    def _call(self, command, *args):
+        result = subprocess.run([self.binary, "api", command, f"--server={self.address}", *args],
+                                capture_output=True, text=True, timeout=self.timeout)
+        if result.returncode != 0:
+            output = (result.stderr or result.stdout).strip().splitlines()
+            raise RuntimeError(f"v2ray api {command} failed: {output[-1] if output else result.returncode}")
+        return result.stdout
+
+    def add_outbound(self, outbound):
+        """Add a (tagged) outbound"""
+        fd, path = tempfile.mkstemp(suffix=".json")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"outbounds": [outbound]}, f)
+            self._call("ado", path)
+        finally:
+            os.unlink(path)
+
+    def remove_outbound(self, tag):
+        """Remove the outbound with this tag"""
+        # Without -tags, `v2ray api rmo` reads its arguments as config files
+        self._call("rmo", "-tags", tag)
+
+def can_hot_swap(old, new, changes):
+    """Whether a running V2Ray can move from config old to new by swapping outbounds
+
+    Only outbound changes qualify (routing, inbounds and everything else
+    need a restart), both configs must expose the API, and every outbound
+    must be tagged so the API can address it.
+    """
+    return (bool(changes)
+            and all(section == "outbounds" and tag for section, tag, _ in changes)
+            and all("HandlerService" in (config.get("api") or {}).get("services", []) for config in (old, new))
+            and all("tag" in outbound for config in (old, new) for outbound in config.get("outbounds", [])))
+
+def hot_swap_outbounds(config, changes, api=None):
+    """Apply outbound changes (see diff_config_sections) to the running V2Ray
+
+    New tags are added first, so a changed outbound that dials through one
+    (the static proxy through its node) finds it; changed outbounds are
+    then replaced under their tag, which keeps the routing rules pointing
+    at them, and dropped outbounds are removed last.
+
+    Routing can't be re-pointed through the API, so a changed outbound is
+    briefly missing between its removal and re-adding. Each one is first
+    added under a staging tag, so an outbound V2Ray rejects fails the swap
+    before the running one is touched. Raises RuntimeError naming the
+    outbound when it was removed but couldn't be re-added.
+    """
+    api = api or V2RayAPI()
+    outbounds = {outbound["tag"]: outbound for outbound in config["outbounds"]}
+    tags = {kind: [tag for _, tag, change in changes if change == kind] for kind in ("added", "changed", "removed")}
+
+    for tag in tags["added"]:
+        api.add_outbound(outbounds[tag])
+
+    for tag in tags["changed"]:
+        staged = f"{tag}{API_STAGING_SUFFIX}"
+        api.add_outbound({**outbounds[tag], "tag": staged})
+        api.remove_outbound(staged)
+
+    for tag in tags["changed"]:
+        api.remove_outbound(tag)
+        try:
+            api.add_outbound(outbounds[tag])
+        except Exception as e:
+            raise RuntimeError(f"outbound '{tag}' was removed but could not be re-added, "
+                               f"its traffic fails until V2Ray restarts: {str(e)}")
+
+    for tag in tags["removed"]:
+        api.remove_outbound(tag)
+
+# ==================== Latency Probe Engine ====================
+PROBE_CONCURRENCY = 256      # Maximum simultaneous connection attempts
+PROBE_SAMPLE_COUNT = 3       # Default samples per node
+PROBE_SAMPLE_INTERVAL = 0.2  # Delay between the samples of one node (seconds)
+OFFLINE_LATENCY = 9999
+DNS_CACHE_TTL = 300          # Seconds a resolved address stays valid
+DNS_NEGATIVE_TTL = 30        # Seconds a failed lookup is remembered before retrying
+DNS_WORKERS = 32             # Resolver threads (getaddrinfo blocks and can't be cancelled)
+PROBE_MODES = ["tcp", "tls"]  # tcp: connect only, tls: connect + full TLS handshake
+HAPPY_EYEBALLS_DELAY = 0.25  # Seconds before racing the next address (RFC 8305)
+ADDRESS_FAMILIES = {socket.AF_INET: "ipv4", socket.AF_INET6: "ipv6"}
+
+def _raise_fd_limit(required):
+    """Raise the soft open-file limit so concurrent probes don't hit EMFILE"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY and soft < required:
+            new_soft = required if hard == resource.RLIM_INFINITY else min(required, hard)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+def _percentile(sorted_values, pct):
+    """Linear-interpolated percentile of an already sorted list"""
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    rank = (len(sorted_values) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+def summarize_latencies(latencies, test_count):
+    """Build a probe result from successful sample latencies (ms)
+
+    "latency" is the median so a single outlier cannot move it; the full
+    distribution (min/p50/p95/max) and jitter (population stddev) are kept
+    alongside it for ranking and display.
+    """
+    if not latencies:
+        return {
+            "status": "offline",
+            "latency": OFFLINE_LATENCY,
+            "success_rate": 0,
+            "samples": 0
+        }
+
+    ordered = sorted(latencies)
+    mean = statistics.fmean(ordered)
+    return {
+        "status": "online",
+        "latency": _percentile(ordered, 50),
+        "mean": mean,
+        "min": ordered[0],
+        "p50": _percentile(ordered, 50),
+        "p95": _percentile(ordered, 95),
+        "max": ordered[-1],
+        "jitter": statistics.pstdev(ordered, mean),
+        "success_rate": len(ordered) / test_count * 100,
+        "samples": len(ordered),
+        "latencies": ordered
+    }
+
+def node_rank_score(result):
+    """Ranking score for a probe result (lower is better)
+
+    Uses median plus jitter, inflated by packet loss, so a node that is
+    consistently fast beats one that got a single lucky sample.
+    """
+    if result.get("status") != "online":
+        return float("inf")
+    score = result.get("p50", result["latency"]) + result.get("jitter", 0)
+    return score * 100 / max(result.get("success_rate", 100), 1)
+
+def _interleave_families(addresses):
+    """Order (family, ip) pairs for happy eyeballs: alternate families, first family first"""
+    by_family = {}
+    for address in addresses:
+        by_family.setdefault(address[0], []).append(address)
+    queues = list(by_family.values())
+    ordered = []
+    while any(queues):
+        for queue in queues:
+            if queue:
+                ordered.append(queue.pop(0))
+    return tuple(ordered)
+
+class DNSCache:
+    """Resolver cache shared by all probes
+
+    Each host is resolved once and reused until DNS_CACHE_TTL expires, so
+    nodes sharing a server don't repeat the lookup and DNS cost is reported
+    apart from connect latency. Concurrent lookups of the same host are
+    coalesced into one request. Both A and AAAA records are kept, as a
+    tuple of (family, ip) pairs in happy-eyeballs order. Failed or timed
+    out lookups are cached too, for DNS_NEGATIVE_TTL, so a dead host isn't
+    retried by every probe.
+
+    Lookups run on a dedicated thread pool rather than the loop's default
+    executor: a getaddrinfo call stuck past its timeout keeps its thread,
+    and asyncio.run would otherwise wait for it on shutdown.
+    """
+
+    def __init__(self, ttl=DNS_CACHE_TTL, negative_ttl=DNS_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = {}  # host -> (expires_at, addresses or None, dns_time_ms)
+        self._inflight = {}
+        self._executor = None
+
+    def get(self, host):
+        """Return a fresh cached (addresses or None, dns_time_ms), or None when not cached"""
+        entry = self._entries.get(host)
+        if entry and entry[0] > time.monotonic():
+            return entry[1], entry[2]
+        return None
+
+    def clear(self):
+        """Drop all cached addresses"""
+        self._entries.clear()
+
+    async def _lookup(self, host, timeout):
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=DNS_WORKERS, thread_name_prefix="dns")
+        start_time = time.perf_counter()
+        try:
+            infos = await asyncio.wait_for(
+                loop.run_in_executor(self._executor, functools.partial(
+                    socket.getaddrinfo, host, None, family=socket.AF_UNSPEC, type=socket.SOCK_STREAM)),
+                timeout
+            )
+        except (OSError, UnicodeError, asyncio.TimeoutError):
+            infos = []
+        dns_time = (time.perf_counter() - start_time) * 1000
+        addresses = _interleave_families(dict.fromkeys(
+            (info[0], info[4][0]) for info in infos if info[0] in ADDRESS_FAMILIES)) or None
+        ttl = self.ttl if addresses else self.negative_ttl
+        self._entries[host] = (time.monotonic() + ttl, addresses, dns_time)
+        return addresses, dns_time
+
+    async def resolve_async(self, host, timeout=5):
+        """Resolve host to all IPv4/IPv6 addresses, returns (addresses or None, dns_time_ms)"""
+        cached = self.get(host)
+        if cached:
+            return cached
+        task = self._inflight.get(host)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(self._lookup(host, timeout))
+            self._inflight[host] = task
+            task.add_done_callback(lambda _: self._inflight.pop(host, None))
+        return await task
+
+    async def resolve_many_async(self, hosts, timeout=5):
+        """Resolve a set of hosts in parallel, returns {host: (addresses, dns_time_ms)}"""
+        unique_hosts = list(dict.fromkeys(hosts))
+        resolved = await asyncio.gather(*(self.resolve_async(h, timeout) for h in unique_hosts))
+        return dict(zip(unique_hosts, resolved))
+
+DNS_CACHE = DNSCache()
+
+async def _happy_eyeballs_connect(addresses, port, timeout):
+    """Race TCP connects to every resolved address, RFC 8305 style
+
+    A new attempt starts every HAPPY_EYEBALLS_DELAY, or as soon as the
+    previous one fails; the first connected socket wins and the others are
+    cancelled. Returns (sock, (family, ip), connect_ms) or None, where
+    connect_ms is the winning attempt's own connect time, so the staggered
+    start doesn't count as latency.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def attempt(family, ip):
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        start_time = time.perf_counter()
+        try:
+            await loop.sock_connect(sock, (ip, port))
+        except BaseException:
+            sock.close()
+            raise
+        return sock, (family, ip), (time.perf_counter() - start_time) * 1000
+
+    remaining = list(addresses)
+    pending = set()
+    deadline = loop.time() + timeout
+    winner = None
+    try:
+        while (remaining or pending) and winner is None:
+            if remaining:
+                pending.add(asyncio.ensure_future(attempt(*remaining.pop(0))))
+            wait_time = deadline - loop.time()
+            if wait_time <= 0:
+                break
+            if remaining:
+                wait_time = min(wait_time, HAPPY_EYEBALLS_DELAY)
+            done, pending = await asyncio.wait(pending, timeout=wait_time,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    continue
+                if winner is None:
+                    winner = task.result()
+                else:
+                    task.result()[0].close()
+    finally:
+        for task in pending:
+            task.cancel()
+    return winner
+
+async def _tcp_connect_sample(addresses, port, timeout, semaphore):
+    """Time a single (happy-eyeballs) TCP connect
+
+    Returns (latency_ms, (family, ip)) of the winning address, or None on failure.
+    """
+    async with semaphore:
+        connected = await _happy_eyeballs_connect(addresses, port, timeout)
+        if connected is None:
+            return None
+        sock, address, latency = connected
+        sock.close()
+        return latency, address
+
+_TLS_CONTEXTS = {}
+
+def _tls_context(alpn="", verify=True):
+    """Build (and reuse) a client SSL context for the node's ALPN list"""
+    protocols = tuple(p.strip() for p in (alpn or "").split(",") if p.strip())
+    key = (protocols, verify)
+    if key not in _TLS_CONTEXTS:
+        context = ssl.create_default_context()
+        if not verify:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        if protocols:
+            context.set_alpn_protocols(list(protocols))
+        _TLS_CONTEXTS[key] = context
+    return _TLS_CONTEXTS[key]
+
+async def _tls_handshake_sample(addresses, port, server_name, context, timeout, semaphore):
+    """Time a TCP connect and the following TLS handshake separately
+
+    Returns None if the TCP connect fails, otherwise a dict with "connect"
+    and "handshake" times in ms ("handshake" is None and "error" is set
+    when the handshake fails), the winning "address", plus the negotiated
+    ALPN and TLS version.
+    """
+    loop = asyncio.get_running_loop()
+    async with semaphore:
+        connected = await _happy_eyeballs_connect(addresses, port, timeout)
+        if connected is None:
+            return None
+        sock, address, connect_time = connected
+        connected_time = time.perf_counter()
+        sample = {"connect": connect_time, "handshake": None, "address": address}
+
+        try:
+            transport, _ = await asyncio.wait_for(
+                loop.create_connection(asyncio.Protocol, sock=sock, ssl=context,
+                                       server_hostname=server_name),
+                timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            sock.close()
+            sample["error"] = str(e) or type(e).__name__
+            return sample
+
+        sample["handshake"] = (time.perf_counter() - connected_time) * 1000
+        ssl_object = transport.get_extra_info("ssl_object")
+        if ssl_object is not None:
+            sample["alpn"] = ssl_object.selected_alpn_protocol()
+            sample["tls_version"] = ssl_object.version()
+        transport.close()
+        return sample
+
+async def probe_node_async(node, timeout=5, test_count=PROBE_SAMPLE_COUNT, semaphore=None,
+                           mode="tcp", verify_tls=True):
+    """Probe one node without blocking the event loop
+
+    Samples are staggered by PROBE_SAMPLE_INTERVAL instead of run back to back,
+    so a node finishes in about one timeout window even when it is offline.
+    The server is resolved through DNS_CACHE and samples connect to the
+    cached addresses, so "latency" is pure TCP connect time and the lookup
+    cost is reported separately as "dns_time". When the server has both
+    IPv4 and IPv6 addresses, every sample races them (happy eyeballs) and
+    the result records the usual winner as "address" and "family".
+
+    In "tls" mode, nodes with TLS enabled also complete a full handshake using
+    the node's SNI and ALPN; "latency" then covers connect + handshake and the
+    result adds "connect_time", "handshake_time", "alpn" and "tls_version".
+    Nodes without TLS fall back to the plain TCP probe.
+    """
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(test_count)
+
+    addresses, dns_time = await DNS_CACHE.resolve_async(node["server"], timeout)
+    if addresses is None:
+        result = summarize_latencies([], test_count)
+        result.update({"dns_time": dns_time, "error": "dns"})
+        return result
+
+    def endpoint_info(winners):
+        """Most frequent winning address, falling back to the first candidate"""
+        if not winners:
+            return {"address": addresses[0][1]}
+        family, ip = collections.Counter(winners).most_common(1)[0][0]
+        return {"address": ip, "family": ADDRESS_FAMILIES[family]}
+
+    if mode == "tls" and node.get("tls") in ["tls", "xtls"]:
+        context = _tls_context(node.get("alpn", ""), verify_tls)
+        server_name = node.get("sni") or node["server"]
+
+        async def tls_sample(i):
+            await asyncio.sleep(i * PROBE_SAMPLE_INTERVAL)
+            return await _tls_handshake_sample(addresses, node["port"], server_name, context, timeout, semaphore)
+
+        samples = [s for s in await asyncio.gather(*(tls_sample(i) for i in range(test_count))) if s]
+        handshakes = [s for s in samples if s["handshake"] is not None]
+        result = summarize_latencies([s["connect"] + s["handshake"] for s in handshakes], test_count)
+        result.update({**endpoint_info([s["address"] for s in handshakes]), "dns_time": dns_time,
+                       "probe_mode": "tls"})
+        if samples:
+            result["connect_time"] = statistics.median(s["connect"] for s in samples)
+        if handshakes:
+            result["handshake_time"] = statistics.median(s["handshake"] for s in handshakes)
+            result["alpn"] = handshakes[-1].get("alpn")
+            result["tls_version"] = handshakes[-1].get("tls_version")
+        elif samples:
+            # TCP reachable but every handshake failed
+            result["error"] = "tls"
+            result["tls_error"] = samples[0].get("error")
+        return result
+
+    async def sample(i):
+        await asyncio.sleep(i * PROBE_SAMPLE_INTERVAL)
+        return await _tcp_connect_sample(addresses, node["port"], timeout, semaphore)
+
+    samples = [s for s in await asyncio.gather(*(sample(i) for i in range(test_count))) if s is not None]
+    result = summarize_latencies([latency for latency, _ in samples], test_count)
+    result.update({**endpoint_info([address for _, address in samples]), "dns_time": dns_time,
+                   "probe_mode": "tcp"})
+    return result
+
+async def probe_nodes_async(nodes, timeout=5, test_count=PROBE_SAMPLE_COUNT, concurrency=PROBE_CONCURRENCY,
+                            on_result=None, mode="tcp", verify_tls=True, time_limit=None):
+    """Probe all nodes concurrently, reporting each one as soon as it completes
+
+    Each unique network endpoint is probed once and its result is reported
+    for every node that shares it.
+
+    Args:
+        nodes: Nodes to probe
+        timeout: Per-connection timeout in seconds
+        test_count: Samples per node
+        concurrency: Maximum simultaneous connection attempts
+        on_result: Optional callback(node, result, error) invoked as results stream in
+        mode: Probe mode, one of PROBE_MODES
+        verify_tls: Verify server certificates in "tls" mode
+        time_limit: Optional overall limit in seconds, DNS lookups included; nodes
+            still pending are dropped
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    def endpoint_key(node, addresses):
+        key = (addresses or node["server"], node["port"])
+        if mode == "tls":
+            key += (node.get("tls"), node.get("sni") or node["server"], node.get("alpn", ""))
+        return key
+
+    # Nodes sharing an endpoint (resolved addresses, port) are probed once, so their
+    # probes don't compete with each other; TLS probes also depend on SNI/ALPN. Hosts
+    # are grouped by name up front and by address once each one resolves, so DNS
+    # runs inside the time limit.
+    endpoints = {}
+    for node in nodes:
+        endpoints.setdefault(endpoint_key(node, None), []).append(node)
+    probes = {}  # resolved endpoint key -> probe task
+
+    async def probe(group):
+        try:
+            addresses, _ = await DNS_CACHE.resolve_async(group[0]["server"], timeout)
+            key = endpoint_key(group[0], addresses)
+            if key not in probes:
+                probes[key] = asyncio.ensure_future(
+                    probe_node_async(group[0], timeout, test_count, semaphore, mode, verify_tls))
+            result = await asyncio.shield(probes[key])
+            return group, result, None
+        except Exception as e:
+            return group, None, e
+
+    results = []
+    try:
+        for future in asyncio.as_completed([probe(group) for group in endpoints.values()], timeout=time_limit):
+            group, result, error = await future
+            for node in group:
+                if on_result:
+                    on_result(node, result, error)
+                if result is not None:
+                    results.append({**node, **result})
+    except asyncio.TimeoutError:
+        pass
+
+    return results
+
+def probe_nodes(nodes, timeout=5, test_count=PROBE_SAMPLE_COUNT, concurrency=PROBE_CONCURRENCY,
+                on_result=None, mode="tcp", verify_tls=True, time_limit=None):
+    """Synchronous entry point for probe_nodes_async"""
+    _raise_fd_limit(concurrency + 64)
+    return asyncio.run(probe_nodes_async(nodes, timeout, test_count, concurrency, on_result,
+                                         mode, verify_tls, time_limit))
+
+def is_valid_node(node):
+    """Check if this is a valid VPN node"""
+    node_name = node.get('name', '').lower()
+    # Filter out subscription metadata entries
+    if any(keyword in node_name for keyword in ['remaining traffic', 'expiry time', 'traffic', 'expire', 'remaining']):
+        return False
+    # Check if node has required fields
+    if not node.get('server') or not node.get('port'):
+        return False
+    # Stored before unsupported ciphers were skipped at parse time
+    if node.get('protocol') == "shadowsocks" and str(node.get('method', 'aes-256-gcm')).lower() not in SHADOWSOCKS_METHODS:
+        return False
+    return True
+
+def test_node_latency(node, timeout=5, test_count=PROBE_SAMPLE_COUNT, mode="tcp", verify_tls=True):
+    """Test node latency (advanced version)"""
+    return asyncio.run(probe_node_async(node, timeout, test_count, mode=mode, verify_tls=verify_tls))
+
+def test_all_nodes(nodes, test_count=PROBE_SAMPLE_COUNT, concurrency=PROBE_CONCURRENCY, mode="tcp",
+                   verify_tls=True, url=None):
+    """Batch test all nodes
+
+    mode is one of PROBE_MODES, or "real" to measure HTTP delay to `url`
+    through each node's actual protocol (see real_delay_test).
+    """
+    if mode not in PROBE_MODES + ["real"]:
+        log(f"Invalid probe mode: {mode}. Use one of: {', '.join(PROBE_MODES + ['real'])}", "ERROR")
+        return None
+
+    mode_titles = {"tcp": "", "tls": " (TLS handshake)", "real": " (real delay)"}
+    print(f"\nTesting all nodes{mode_titles[mode]}, please wait...")
+    
+    # Filter out non-node entries (like subscription metadata)
+    valid_nodes = [node for node in nodes if is_valid_node(node)]
+    
+    if not valid_nodes:
+        print(f"{Colors.RED}No valid nodes to test!{Colors.END}")
+        return None
+
+    # Calculate string display width in terminal (Chinese characters take 2 widths)
+    def get_display_width(s):
+        """Calculate string display width in terminal"""
+        width = 0
+        for char in s:
+            if '\u4e00' <= char <= '\u9fff':  # Chinese character range
+                width += 2
+            else:
+                width += 1
+        return width
+
+    # Format string to specified width
+    def pad_to_width(text, target_width):
+        """Pad text to specified display width"""
+        current_width = get_display_width(text)
+        padding_needed = target_width - current_width
+        if padding_needed > 0:
+            return text + ' ' * padding_needed
+        return text
+
+    # Define column widths
+    NAME_WIDTH = 35
+    REGION_WIDTH = 10
+    STATUS_WIDTH = 10
+    LATENCY_WIDTH = 13
+    JITTER_WIDTH = 12
+    RATE_WIDTH = 10
+
+    # Print header
+    print("="*97)
+    header = (
+        f"{pad_to_width('Node Name', NAME_WIDTH)}"
+        f"{pad_to_width('Region', REGION_WIDTH)}"
+        f"{pad_to_width('Status', STATUS_WIDTH)}"
+        f"{pad_to_width({'tcp': 'Latency(ms)', 'tls': 'TLS(ms)', 'real': 'Delay(ms)'}[mode], LATENCY_WIDTH)}"
+        f"{pad_to_width('Jitter(ms)', JITTER_WIDTH)}"
+        f"Success Rate"
+    )
+    print(header)
+    print("="*97)
+
+    def print_result(node, result, error):
+        """Render one table row as soon as its probe completes"""
+        if error is not None:
+            # Error handling
+            line = (
+                f"{pad_to_width(node['name'], NAME_WIDTH)}"
+                f"{pad_to_width(node.get('region', 'Unknown'), REGION_WIDTH)}"
+                f"{Colors.RED}Error{Colors.END}"
+            )
+            print(line)
+            return
+
+        # Prepare column data
+        name = node['name']
+        region = node.get('region', 'Unknown')
+
+        # Display results in real-time
+        if result["status"] == "online":
+            latency_val = f"{result['latency']:.1f}"
+            if result['latency'] <= 80:
+                latency_colored = f"{Colors.GREEN}{latency_val}{Colors.END}"
+            elif result['latency'] <= 150:
+                latency_colored = f"{Colors.YELLOW}{latency_val}{Colors.END}"
+            else:
+                latency_colored = f"{Colors.RED}{latency_val}{Colors.END}"
+
+            # Format success rate with color
+            success_rate = result['success_rate']
+            success_rate_val = f"{success_rate:.0f}%"
+            if success_rate >= 90:
+                success_rate_colored = f"{Colors.GREEN}{success_rate_val}{Colors.END}"
+            elif success_rate >= 80:
+                success_rate_colored = f"{Colors.YELLOW}{success_rate_val}{Colors.END}"
+            else:
+                success_rate_colored = f"{Colors.RED}{success_rate_val}{Colors.END}"
+
+            # Jitter relative to the median shows how stable the node is
+            jitter_val = f"±{result['jitter']:.1f}"
+            if result['jitter'] <= max(result['latency'] * 0.1, 5):
+                jitter_colored = f"{Colors.GREEN}{jitter_val}{Colors.END}"
+            elif result['jitter'] <= max(result['latency'] * 0.3, 15):
+                jitter_colored = f"{Colors.YELLOW}{jitter_val}{Colors.END}"
+            else:
+                jitter_colored = f"{Colors.RED}{jitter_val}{Colors.END}"
+
+            # Build output line
+            line = (
+                f"{pad_to_width(name, NAME_WIDTH)}"
+                f"{pad_to_width(region, REGION_WIDTH)}"
+                f"{Colors.GREEN}Online{Colors.END}{' ' * (STATUS_WIDTH - get_display_width('Online'))}"
+                f"{latency_colored}{' ' * (LATENCY_WIDTH - get_display_width(latency_val))}"
+                f"{jitter_colored}{' ' * (JITTER_WIDTH - get_display_width(jitter_val))}"
+                f"{success_rate_colored}"
+            )
+        else:
+            # Offline status (reachable nodes whose TLS handshake failed are flagged separately)
+            success_rate = result['success_rate']
+            success_rate_val = f"{success_rate:.0f}%"
+            success_rate_colored = f"{Colors.RED}{success_rate_val}{Colors.END}"
+            if result.get("error") == "tls":
+                status_val = "TLS Fail"
+            elif mode == "real":
+                status_val = "Failed"
+            else:
+                status_val = "Offline"
+
+            line = (
+                f"{pad_to_width(name, NAME_WIDTH)}"
+                f"{pad_to_width(region, REGION_WIDTH)}"
+                f"{Colors.RED}{status_val}{Colors.END}{' ' * (STATUS_WIDTH - get_display_width(status_val))}"
+                f"-{' ' * (LATENCY_WIDTH - 1)}"
+                f"-{' ' * (JITTER_WIDTH - 1)}"
+                f"{success_rate_colored}"
+            )
+
+        print(line)
+
+    # Probe every node concurrently on the asyncio engine, streaming rows as they finish
+    if mode == "real":
+        results = real_delay_test(valid_nodes, url=url or REAL_DELAY_URL, concurrency=concurrency,
+                                  on_result=print_result)
+    else:
+        results = probe_nodes(valid_nodes, test_count=test_count, concurrency=concurrency,
+                              on_result=print_result, mode=mode, verify_tls=verify_tls)
+
+    print("="*97)
+
+    # Keep connect-latency results so later runs and node switching can use them
+    if mode == "tcp":
+        record_probe_results(results)
+
+    # Statistics
+    online_nodes = [n for n in results if n["status"] == "online"]
+    if online_nodes:
+        median_latency = statistics.median(n["latency"] for n in online_nodes)
+        best_node = min(online_nodes, key=node_rank_score)
+        print(f"\nOnline nodes: {len(online_nodes)}/{len(valid_nodes)}")
+        print(f"Median latency: {median_latency:.1f}ms")
+        print(f"\n{Colors.GREEN}Recommended node: {best_node['name']} "
+              f"(p50: {best_node['p50']:.1f}ms, p95: {best_node['p95']:.1f}ms, jitter: ±{best_node['jitter']:.1f}ms){Colors.END}")
+        if best_node.get("handshake_time") is not None:
+            print(f"TLS handshake: {best_node['handshake_time']:.1f}ms "
+                  f"({best_node.get('tls_version')}, ALPN: {best_node.get('alpn') or 'none'})")
+        return best_node
+    else:
+        print(f"\n{Colors.RED}All nodes are unreachable!{Colors.END}")
+        return None
+
+# ==================== Real Delay Test ====================
+REAL_DELAY_URL = "http://www.gstatic.com/generate_204"
+REAL_DELAY_STARTUP_TIMEOUT = 10  # Seconds to wait for the test v2ray process to listen
+
+def _allocate_local_ports(count):
+    """Reserve `count` free loopback TCP ports (released before returning)"""
+    sockets = []
+    try:
+        for _ in range(count):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.bind(("127.0.0.1", 0))
+            sockets.append(sock)
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for sock in sockets:
+            sock.close()
+
+def build_real_delay_config(nodes, ports):
+    """Build one V2Ray config that exposes every node on its own local port
+
+    Node i gets an HTTP inbound on 127.0.0.1:ports[i] tagged "test-in-i",
+    routed to its outbound "test-node-i", so a single process can measure
+    all nodes concurrently.
+    """
+    config = {
+        "log": {
+            "loglevel": "none"
+        },
+        "inbounds": [],
+        "outbounds": [],
+        "routing": {
+            "rules": []
+        }
+    }
+
+    for i, (node, port) in enumerate(zip(nodes, ports)):
+        outbound = build_node_outbound(node)
+        outbound["tag"] = f"test-node-{i}"
+        config["inbounds"].append({
+            "tag": f"test-in-{i}",
+            "listen": "127.0.0.1",
+            "port": port,
+            "protocol": "http",
+            "settings": {}
+        })
+        config["outbounds"].append(outbound)
+        config["routing"]["rules"].append({
+            "type": "field",
+            "inboundTag": [f"test-in-{i}"],
+            "outboundTag": f"test-node-{i}"
+        })
+
+    return config
+
+async def _read_http_head(sock, loop, limit=65536):
+    """Read raw bytes from a socket until the end of the HTTP header block"""
+    data = b""
+    while b"\r\n\r\n" not in data:
+        chunk = await loop.sock_recv(sock, 4096)
+        if not chunk or len(data) > limit:
+            raise ConnectionError("Proxy closed connection")
+        data += chunk
+    return data
+
+async def open_http_via_proxy(proxy_port, url, proxy_host="127.0.0.1"):
+    """Send GET url through a local HTTP proxy inbound, returns (reader, writer)
+
+    https URLs are tunnelled with CONNECT and then wrapped in TLS; plain http
+    URLs are sent in absolute form. The caller reads the response.
+    """
+    parsed = urlparse(url)
+    https = parsed.scheme == "https"
+    host = parsed.hostname
+    port = parsed.port or (443 if https else 80)
+    path = parsed.path or "/"
+    if parsed.query:
+        path += "?" + parsed.query
+
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    try:
+        await loop.sock_connect(sock, (proxy_host, proxy_port))
+        if https:
+            await loop.sock_sendall(sock, f"CONNECT {host}:{port} HTTP/1.1\r\nHost: {host}:{port}\r\n\r\n".encode())
+            head = await _read_http_head(sock, loop)
+            if int(head.split(b" ", 2)[1]) != 200:
+                raise ConnectionError(f"CONNECT refused: {head.splitlines()[0].decode(errors='replace')}")
+            reader, writer = await asyncio.open_connection(sock=sock, ssl=_tls_context(), server_hostname=host)
+            target = path
+        else:
+            reader, writer = await asyncio.open_connection(sock=sock)
+            target = url
+    except BaseException:
+        sock.close()
+        raise
+
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: {parsed.netloc}\r\nUser-Agent: v2ray_command\r\n"
+                 f"Connection: close\r\n\r\n".encode())
+    return reader, writer
+
+async def http_request_via_proxy(proxy_port, url, timeout=10, proxy_host="127.0.0.1"):
+    """Time one HTTP GET through a local HTTP proxy inbound
+
+    Returns (status_code, elapsed_ms) once the response status line arrives.
+    """
+    start_time = time.perf_counter()
+    writer = None
+
+    async def request():
+        nonlocal writer
+        reader, writer = await open_http_via_proxy(proxy_port, url, proxy_host)
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Empty response")
+        return int(status_line.split(b" ", 2)[1])
+
+    try:
+        status = await asyncio.wait_for(request(), timeout)
+        return status, (time.perf_counter() - start_time) * 1000
+    finally:
+        if writer is not None:
+            writer.close()
+
+async def _real_delay_node_async(port, test_count, url, timeout, semaphore):
+    """Measure one node through its test inbound"""
+    latencies = []
+    last_error = None
+    for i in range(test_count):
+        async with semaphore:
+            try:
+                status, elapsed = await http_request_via_proxy(port, url, timeout)
+                if status < 400:
+                    latencies.append(elapsed)
+                else:
+                    last_error = f"HTTP {status}"
+            except (OSError, ValueError, IndexError, asyncio.TimeoutError) as e:
+                last_error = str(e) or type(e).__name__
+    result = summarize_latencies(latencies, test_count)
+    result["probe_mode"] = "real"
+    if not latencies:
+        result["error"] = last_error
+    return result
+
+class TestV2RayInstance:
+    """Temporary V2Ray process exposing each node on its own loopback port
+
+    Used as a context manager; the process and its config directory are
+    cleaned up on exit. `ports[i]` is the HTTP inbound routed to `nodes[i]`.
+    The process log goes to a file in that directory rather than a pipe,
+    which nobody drains while the test runs and would stall V2Ray once full.
+    """
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.ports = []
+        self.process = None
+        self.temp_dir = None
+        self.log_file = None
+
+    def __enter__(self):
+        self.ports = _allocate_local_ports(len(self.nodes))
+        self.temp_dir = tempfile.mkdtemp(prefix="v2ray-test-")
+        config_path = os.path.join(self.temp_dir, "config.json")
+        with open(config_path, 'w', encoding='utf-8') as f:
+            json.dump(build_real_delay_config(self.nodes, self.ports), f)
+
+        self.log_file = open(os.path.join(self.temp_dir, "v2ray.log"), 'w+', encoding='utf-8', errors='replace')
+        self.process = subprocess.Popen(
+            [CONFIG.V2RAY_BIN, "run", "-config", config_path],
+            stdout=subprocess.DEVNULL,
+            stderr=self.log_file,
+            text=True
+        )
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.process:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.log_file:
+            self.log_file.close()
+        if self.temp_dir:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    async def wait_ready(self, timeout=REAL_DELAY_STARTUP_TIMEOUT):
+        """Wait until the last inbound listens; False if the process died or timed out"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                return False
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", self.ports[-1]), 0.5)
+                writer.close()
+                return True
+            except (OSError, asyncio.TimeoutError):
+                await asyncio.sleep(0.1)
+        return False
+
+    def startup_error(self):
+        """Return the reason the process failed to start"""
+        stderr = ""
+        if self.process.poll() is not None:
+            self.log_file.seek(0)
+            stderr = self.log_file.read()[-2000:].strip()
+        return f"Test V2Ray process failed to start{': ' + stderr if stderr else ''}"
+
+def real_delay_test(nodes, url=REAL_DELAY_URL, timeout=10, test_count=2,
+                    concurrency=PROBE_CONCURRENCY, on_result=None):
+    """Measure real HTTP delay through each node's actual vmess/vless protocol
+
+    All nodes share one temporary V2Ray process built by build_real_delay_config,
+    so an expired uuid or wrong ws path shows up as a failure instead of a
+    reachable TCP port. The first request through each node includes the
+    protocol handshake; the median over test_count requests is reported.
+
+    Args:
+        nodes: Nodes to test
+        url: Target URL, any endpoint answering with a non-error status
+        timeout: Per-request timeout in seconds
+        test_count: Requests per node
+        concurrency: Maximum simultaneous requests
+        on_result: Optional callback(node, result, error) invoked as results stream in
+    """
+    if not nodes:
+        return []
+    if not os.path.exists(CONFIG.V2RAY_BIN):
+        log(f"V2Ray binary not found at {CONFIG.V2RAY_BIN}, cannot run real delay test", "ERROR")
+        return []
+
+    _raise_fd_limit(len(nodes) * 2 + concurrency * 3 + 64)
+
+    with TestV2RayInstance(nodes) as instance:
+        async def run():
+            if not await instance.wait_ready():
+                return None
+
+            semaphore = asyncio.Semaphore(max(1, concurrency))
+
+            async def measure(port, node):
+                try:
+                    return node, await _real_delay_node_async(port, test_count, url, timeout, semaphore), None
+                except Exception as e:
+                    return node, None, e
+
+            results = []
+            for future in asyncio.as_completed([measure(port, node) for port, node in zip(instance.ports, nodes)]):
+                node, result, error = await future
+                if on_result:
+                    on_result(node, result, error)
+                if result is not None:
+                    results.append({**node, **result})
+            return results
+
+        results = asyncio.run(run())
+        if results is None:
+            log(instance.startup_error(), "ERROR")
+            return []
+        return results
+
+# ==================== Speed Test ====================
+SPEEDTEST_URL = "https://speed.cloudflare.com/__down?bytes=200000000"
+SPEEDTEST_STREAMS = 4
+SPEEDTEST_DURATION = 10  # Seconds to keep downloading
+STALL_THRESHOLD = 1.0    # Seconds without data that count as a stall
+
+async def _download_stream(proxy_port, url, duration, timeout):
+    """Download through the proxy for `duration` seconds, returns stream stats"""
+    start_time = time.perf_counter()
+    reader, writer = await asyncio.wait_for(open_http_via_proxy(proxy_port, url), timeout)
+    stats = {"bytes": 0, "ttfb": None, "stalls": 0, "stall_time": 0.0, "first_byte_at": None}
+    try:
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        if not status_line:
+            raise ConnectionError("Empty response")
+        status = int(status_line.split(b" ", 2)[1])
+        if status >= 400:
+            raise ConnectionError(f"HTTP {status}")
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if line in (b"\r\n", b"\n", b""):
+                break
+
+        deadline = start_time + duration
+        stalled = False
+        idle_since = time.perf_counter()
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                chunk = await asyncio.wait_for(reader.read(65536), min(STALL_THRESHOLD, remaining))
+            except asyncio.TimeoutError:
+                if time.perf_counter() >= deadline:
+                    break
+                if not stalled:
+                    stats["stalls"] += 1
+                    stalled = True
+                stats["stall_time"] += STALL_THRESHOLD
+                if time.perf_counter() - idle_since > timeout:
+                    break
+                continue
+            if not chunk:
+                break
+            now = time.perf_counter()
+            if stats["ttfb"] is None:
+                stats["ttfb"] = (now - start_time) * 1000
+                stats["first_byte_at"] = now
+            stats["bytes"] += len(chunk)
+            stalled = False
+            idle_since = now
+    finally:
+        writer.close()
+    stats["end_at"] = time.perf_counter()
+    return stats
+
+def speed_test_node(node, url=SPEEDTEST_URL, streams=SPEEDTEST_STREAMS, duration=SPEEDTEST_DURATION, timeout=10):
+    """Measure download throughput through a node with parallel streams
+
+    The node runs in a temporary V2Ray instance, so the active service is
+    not touched. Returns a dict with sustained Mbps (measured from the first
+    received byte), median time-to-first-byte, stall count and per-stream
+    failures, or None if the test instance could not start.
+    """
+    if not os.path.exists(CONFIG.V2RAY_BIN):
+        log(f"V2Ray binary not found at {CONFIG.V2RAY_BIN}, cannot run speed test", "ERROR")
+        return None
+
+    with TestV2RayInstance([node]) as instance:
+        async def run():
+            if not await instance.wait_ready():
+                return None
+            return await asyncio.gather(
+                *(_download_stream(instance.ports[0], url, duration, timeout) for _ in range(streams)),
+                return_exceptions=True
+            )
+
+        outcomes = asyncio.run(run())
+        if outcomes is None:
+            log(instance.startup_error(), "ERROR")
+            return None
+
+    finished = [o for o in outcomes if isinstance(o, dict) and o["ttfb"] is not None]
+    errors = [str(o) or type(o).__name__ for o in outcomes if isinstance(o, Exception)]
+    result = {
+        "streams": streams,
+        "streams_ok": len(finished),
+        "bytes": sum(o["bytes"] for o in finished),
+        "stalls": sum(o["stalls"] for o in finished),
+        "stall_time": sum(o["stall_time"] for o in finished),
+        "errors": errors
+    }
+    if not finished:
+        result.update({"status": "failed", "mbps": 0, "ttfb": None})
+        return result
+
+    window = max(o["end_at"] for o in finished) - min(o["first_byte_at"] for o in finished)
+    result.update({
+        "status": "ok",
+        "mbps": result["bytes"] * 8 / max(window, 0.001) / 1_000_000,
+        "ttfb": statistics.median(o["ttfb"] for o in finished)
+    })
+    return result
+
+def run_speed_test(node=None, url=SPEEDTEST_URL, streams=SPEEDTEST_STREAMS, duration=SPEEDTEST_DURATION):
+    """Run and display a speed test (defaults to the current node)"""
+    if node is None:
+        node = get_current_node()
+        if not node:
+            log("Unable to identify current node", "ERROR")
+            return None
+
+    print(f"\nSpeed testing node: {node['name']}")
+    print(f"Streams: {streams}, Duration: {duration}s")
+    print(f"Source: {url}")
+
+    result = speed_test_node(node, url=url, streams=streams, duration=duration)
+    if result is None:
+        return None
 
-        # Route all traffic through static proxy
-        config["routing"]["rules"] = [{
-            "type": "field",
-            "network": "tcp,udp",
-            "outboundTag": "static-proxy"
-        }]
+    if result["status"] == "ok":
+        print(f"✓ Throughput: {Colors.GREEN}{result['mbps']:.2f} Mbps{Colors.END}")
+        print(f"✓ Time to first byte: {result['ttfb']:.1f}ms")
+        print(f"✓ Downloaded: {result['bytes'] / 1_000_000:.1f} MB over {result['streams_ok']}/{result['streams']} streams")
+        stall_color = Colors.GREEN if result["stalls"] == 0 else Colors.YELLOW
+        print(f"✓ Stalls: {stall_color}{result['stalls']}{Colors.END} ({result['stall_time']:.1f}s idle)")
     else:
-        # Level-1 proxy mode: Local -> V2Ray Node -> Internet
-        config["outbounds"] = [outbound]
+        print(f"✗ Speed test failed")
+    for error in result["errors"]:
+        print(f"  Stream error: {error}")
+    return result
 
-    return config
+def speed_test_settings(streams=None, duration=None):
+    """Validate user-entered streams/duration (None or "" keeps the default)
 
-def test_node_latency(node, timeout=5, test_count=3):
-    """Test node latency (advanced version)"""
-    latencies = []
+    Returns (streams, duration). Raises ValueError unless streams is an
+    integer >= 1 and duration a positive number.
+    """
+    streams = int(streams) if streams else SPEEDTEST_STREAMS
+    duration = float(duration) if duration else SPEEDTEST_DURATION
+    if streams < 1 or duration <= 0:
+        raise ValueError("streams must be at least 1 and duration positive")
+    return streams, duration
+
+# ==================== Node History ====================
+HISTORY_SIZE = 20         # Samples kept per node (ring buffer)
+HISTORY_ALPHA = 0.3       # EWMA weight of the newest sample
+HISTORY_CANDIDATES = 20   # Nodes quick_start probes first when history exists
+HISTORY_MAX_AGE = 30 * 86400  # Entries not probed for this long are dropped
+
+def load_history():
+    """Load node latency history, keyed by node_identity"""
+    try:
+        with _NODE_STORE_LOCK:
+            rows = get_node_store().execute(
+                "SELECT identity, latency, success, family, address, samples FROM probe_results").fetchall()
+    except Exception as e:
+        log(f"Failed to load node history: {str(e)}", "WARNING")
+        return {}
 
-    for _ in range(test_count):
-        try:
-            start_time = time.time()
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(timeout)
-            result = sock.connect_ex((node["server"], node["port"]))
-            sock.close()
+    history = {}
+    for key, latency, success, family, address, samples in rows:
+        history[key] = {"samples": json.loads(samples), "latency": latency, "success": success}
+        if family:
+            history[key].update(family=family, address=address)
+    return history
 
-            if result == 0:
-                latency = (time.time() - start_time) * 1000
-                latencies.append(latency)
+def save_history(history):
+    """Write the given history entries and drop entries older than HISTORY_MAX_AGE
 
-            time.sleep(0.2)
-        except:
-            pass
+    Entries of nodes not in history are left as they are.
+    """
+    try:
+        db = get_node_store()
+        with _NODE_STORE_LOCK, db:
+            db.executemany("INSERT OR REPLACE INTO probe_results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           [_history_row(key, entry) for key, entry in history.items()])
+            db.execute("DELETE FROM probe_results WHERE updated <= ?", (int(time.time()) - HISTORY_MAX_AGE,))
+    except Exception as e:
+        log(f"Failed to save node history: {str(e)}", "WARNING")
 
-    if latencies:
-        avg_latency = sum(latencies) / len(latencies)
-        return {
-            "status": "online",
-            "latency": avg_latency,
-            "success_rate": len(latencies) / test_count * 100
-        }
-    else:
-        return {
-            "status": "offline",
-            "latency": 9999,
-            "success_rate": 0
-        }
+def delete_history(keys):
+    """Forget the history of the given node identities"""
+    db = get_node_store()
+    with _NODE_STORE_LOCK, db:
+        db.executemany("DELETE FROM probe_results WHERE identity = ?", [(key,) for key in keys])
 
-def test_all_nodes(nodes):
-    """Batch test all nodes"""
-    print("\nTesting all nodes, please wait...")
-    
-    # Filter out non-node entries (like subscription metadata)
-    def is_valid_node(node):
-        """Check if this is a valid VPN node"""
-        node_name = node.get('name', '').lower()
-        # Filter out subscription metadata entries
-        if any(keyword in node_name for keyword in ['remaining traffic', 'expiry time', 'traffic', 'expire', 'remaining']):
-            return False
-        # Check if node has required fields
-        if not node.get('server') or not node.get('port'):
-            return False
-        return True
-    
-    # Filter nodes
+def update_history_entry(entry, result, timestamp=None):
+    """Fold one probe result into a history entry (ring buffer + EWMA)
+
+    Each entry stores samples as [timestamp, latency or null], an EWMA of
+    online latency, an EWMA of success rate (0-1) and the address family
+    that last won the node's happy-eyeballs race.
+    """
+    entry = entry or {"samples": [], "latency": None, "success": None}
+    online = result.get("status") == "online"
+    latency = round(result["latency"], 1) if online else None
+    success = result.get("success_rate", 0) / 100
+
+    entry["samples"] = (entry["samples"] + [[int(timestamp or time.time()), latency]])[-HISTORY_SIZE:]
+    if online:
+        entry["latency"] = latency if entry["latency"] is None else round(
+            HISTORY_ALPHA * latency + (1 - HISTORY_ALPHA) * entry["latency"], 1)
+    entry["success"] = success if entry["success"] is None else round(
+        HISTORY_ALPHA * success + (1 - HISTORY_ALPHA) * entry["success"], 3)
+    if online and result.get("family"):
+        entry["family"] = result["family"]
+        entry["address"] = result.get("address")
+    return entry
+
+def record_probe_results(results):
+    """Store probe results (node dicts merged with probe results) in the history"""
+    if not results:
+        return
+    history = load_history()
+    now = int(time.time())
+    updated = {}
+    for result in results:
+        key = node_identity(result)
+        updated[key] = update_history_entry(history.get(key), result, now)
+    save_history(updated)
+
+def history_score(entry):
+    """Score a history entry (lower is better, None when never seen online)"""
+    if not entry or entry.get("latency") is None:
+        return None
+    return entry["latency"] / max(entry.get("success") or 0, 0.05)
+
+def with_preferred_family(node, history=None):
+    """Return the node tagged with the address family that won its last probes
+
+    Nodes without a recorded family are returned unchanged, so v2ray keeps
+    its default resolution for them.
+    """
+    history = load_history() if history is None else history
+    family = (history.get(node_identity(node)) or {}).get("family")
+    return as_node(node).replace(family=family) if family else node
+
+def rank_nodes_by_history(nodes, history=None):
+    """Sort nodes by history score; nodes without history keep their order at the end"""
+    history = load_history() if history is None else history
+    scores = [history_score(history.get(node_identity(node))) for node in nodes]
+    order = sorted(range(len(nodes)), key=lambda i: (scores[i] is None, scores[i] or 0, i))
+    return [nodes[i] for i in order]
+
+# ==================== Adaptive Node Selection ====================
+SELECT_TIME_BUDGET = 20      # Overall seconds select_best_node may spend
+SELECT_FIRST_TIMEOUT = 2     # Connect timeout of the cheap first-round probe
+SELECT_CONTENDERS = 16       # Nodes kept after the first round
+SELECT_ROUND_SAMPLES = 3     # Samples per contender in each later round
+SELECT_MAX_ROUNDS = 6
+SELECT_MIN_SUCCESS = 50      # Contenders below this success rate (%) are dropped
+SELECT_CONFIDENCE_Z = 2.0    # Width of the confidence interval used to stop early
+
+def _latency_interval(latencies):
+    """Return (mean, half-width) of an approximate confidence interval for the mean"""
+    mean = statistics.fmean(latencies)
+    if len(latencies) < 2:
+        return mean, float("inf")
+    return mean, SELECT_CONFIDENCE_Z * statistics.stdev(latencies) / len(latencies) ** 0.5
+
+def select_best_node(nodes, time_budget=SELECT_TIME_BUDGET, concurrency=PROBE_CONCURRENCY,
+                     mode="tcp", verify_tls=True):
+    """Find the best node with successive rounds of increasingly expensive probes
+
+    Round 1 sends one cheap probe to every node and keeps the fastest
+    SELECT_CONTENDERS. Each later round adds SELECT_ROUND_SAMPLES samples to
+    the remaining contenders, drops lossy ones and halves the field. The
+    search stops as soon as the leader's confidence interval no longer
+    overlaps the runner-up's, or when rounds or the time budget run out.
+
+    mode and verify_tls are passed to probe_nodes, so selection can rank by
+    TLS handshake cost instead of TCP connect time.
+
+    Returns the best node merged with its accumulated probe result, or None.
+    """
     valid_nodes = [node for node in nodes if is_valid_node(node)]
-    
     if not valid_nodes:
         print(f"{Colors.RED}No valid nodes to test!{Colors.END}")
         return None
 
-    # Calculate string display width in terminal (Chinese characters take 2 widths)
-    def get_display_width(s):
-        """Calculate string display width in terminal"""
-        width = 0
-        for char in s:
-            if '\u4e00' <= char <= '\u9fff':  # Chinese character range
-                width += 2
-            else:
-                width += 1
-        return width
+    start_time = time.monotonic()
+    deadline = start_time + time_budget
+    print(f"\nSelecting best node from {len(valid_nodes)} nodes (time budget: {time_budget}s)...")
+
+    # Round 1: one cheap probe per node, bounded to half of the budget
+    first_round = probe_nodes(valid_nodes, timeout=SELECT_FIRST_TIMEOUT, test_count=1,
+                              concurrency=concurrency, mode=mode, verify_tls=verify_tls,
+                              time_limit=time_budget / 2)
+    if mode == "tcp":
+        record_probe_results(first_round)
+
+    nodes_by_key = {node_identity(node): node for node in valid_nodes}
+    samples = {}
+    attempts = {}
+    for result in first_round:
+        key = node_identity(result)
+        samples[key] = list(result.get("latencies", []))
+        attempts[key] = 1
+
+    online = sorted((key for key in samples if samples[key]), key=lambda key: samples[key][0])
+    print(f"  Round 1: {len(first_round)}/{len(valid_nodes)} probed, {len(online)} online")
+    if not online:
+        print(f"\n{Colors.RED}All nodes are unreachable!{Colors.END}")
+        return None
 
-    # Format string to specified width
-    def pad_to_width(text, target_width):
-        """Pad text to specified display width"""
-        current_width = get_display_width(text)
-        padding_needed = target_width - current_width
-        if padding_needed > 0:
-            return text + ' ' * padding_needed
-        return text
+    def summary(key):
+        return summarize_latencies(samples[key], attempts[key])
 
-    # Define column widths
-    NAME_WIDTH = 35
-    REGION_WIDTH = 10
-    STATUS_WIDTH = 10
-    LATENCY_WIDTH = 15
-    RATE_WIDTH = 10
+    contenders = online[:SELECT_CONTENDERS]
+    round_no = 1
+    while len(contenders) > 1 and round_no < SELECT_MAX_ROUNDS:
+        remaining = deadline - time.monotonic()
+        if remaining < 0.5:
+            break
+        round_no += 1
+
+        round_results = probe_nodes([nodes_by_key[key] for key in contenders],
+                                    timeout=min(5, remaining), test_count=SELECT_ROUND_SAMPLES,
+                                    concurrency=concurrency, mode=mode, verify_tls=verify_tls,
+                                    time_limit=remaining)
+        for result in round_results:
+            key = node_identity(result)
+            samples[key].extend(result.get("latencies", []))
+            attempts[key] += SELECT_ROUND_SAMPLES
+
+        ranked = sorted(
+            (key for key in contenders
+             if samples[key] and summary(key)["success_rate"] >= SELECT_MIN_SUCCESS),
+            key=lambda key: node_rank_score(summary(key))
+        )
+        if not ranked:
+            contenders = []
+            break
 
-    # Print header
-    print("="*85)
-    header = (
-        f"{pad_to_width('Node Name', NAME_WIDTH)}"
-        f"{pad_to_width('Region', REGION_WIDTH)}"
-        f"{pad_to_width('Status', STATUS_WIDTH)}"
-        f"{pad_to_width('Latency(ms)', LATENCY_WIDTH)}"
-        f"Success Rate"
-    )
-    print(header)
-    print("="*85)
+        settled = False
+        if len(ranked) > 1:
+            best_mean, best_width = _latency_interval(samples[ranked[0]])
+            second_mean, second_width = _latency_interval(samples[ranked[1]])
+            settled = best_mean + best_width < second_mean - second_width
+
+        print(f"  Round {round_no}: {len(ranked)} contenders, leader {nodes_by_key[ranked[0]]['name']} "
+              f"({summary(ranked[0])['p50']:.1f}ms)")
+        if settled:
+            print(f"  Leader is settled (confidence interval separated from runner-up)")
+            contenders = ranked
+            break
+        contenders = ranked[:max(2, len(ranked) // 2)]
 
-    results = []
+    if not contenders:
+        print(f"\n{Colors.RED}No stable node found!{Colors.END}")
+        return None
 
-    # Use thread pool for concurrent testing
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_node = {executor.submit(test_node_latency, node): node for node in valid_nodes}
+    best_key = min(contenders, key=lambda key: node_rank_score(summary(key)))
+    best_node = {**nodes_by_key[best_key], **summary(best_key)}
+    elapsed = time.monotonic() - start_time
+    print(f"\n{Colors.GREEN}Recommended node: {best_node['name']} "
+          f"(p50: {best_node['p50']:.1f}ms, jitter: ±{best_node['jitter']:.1f}ms, "
+          f"{best_node['samples']} samples){Colors.END}")
+    print(f"Selection finished in {elapsed:.1f}s after {round_no} round(s)")
+    return best_node
+
+# ==================== Health Monitor ====================
+MONITOR_INTERVAL = 30          # Seconds between checks of the current node
+MONITOR_WINDOW = 10            # Checks kept in the sliding window
+MONITOR_MIN_SAMPLES = 3        # Checks needed before the window is judged
+MONITOR_MAX_LATENCY = 300      # Window median latency (ms) considered degraded
+MONITOR_MAX_FAILURE_RATE = 50  # Window failure rate (%) considered degraded
+MONITOR_TRIGGER_COUNT = 3      # Consecutive degraded checks before failing over
+MONITOR_COOLDOWN = 600         # Minimum seconds between two failovers
+MONITOR_IMPROVEMENT = 0.2      # Standby must be this much faster than the degraded node
+# "monitor" command line option -> (NodeMonitor argument, type)
+MONITOR_CLI_OPTIONS = {
+    "interval": ("interval", float),
+    "max-latency": ("max_latency", float),
+    "max-failure": ("max_failure_rate", float),
+    "cooldown": ("cooldown", float),
+    "min-samples": ("min_samples", int)
+}
+
+class NodeMonitor:
+    """Watch the active node and fail over to the best standby when it degrades
+
+    Every check probes the current node into a sliding window. A failover
+    needs MONITOR_TRIGGER_COUNT consecutive degraded checks, a standby that
+    is clearly better (MONITOR_IMPROVEMENT) and an expired cooldown, so a
+    brief hiccup or two similar nodes don't cause flapping.
+
+    get_current, get_candidates and apply default to get_current_node,
+    get_available_nodes and apply_node_config; they can be replaced to run
+    the monitor against local stand-in nodes.
+    """
 
-        for future in as_completed(future_to_node):
-            node = future_to_node[future]
+    def __init__(self, interval=MONITOR_INTERVAL, window=MONITOR_WINDOW, max_latency=MONITOR_MAX_LATENCY,
+                 max_failure_rate=MONITOR_MAX_FAILURE_RATE, cooldown=MONITOR_COOLDOWN,
+                 trigger_count=MONITOR_TRIGGER_COUNT, min_samples=MONITOR_MIN_SAMPLES, timeout=5,
+                 get_current=None, get_candidates=None, apply=None):
+        self.interval = interval
+        self.window = collections.deque(maxlen=window)
+        self.max_latency = max_latency
+        self.max_failure_rate = max_failure_rate
+        self.cooldown = cooldown
+        self.trigger_count = trigger_count
+        self.min_samples = min_samples
+        self.timeout = timeout
+        self.get_current = get_current or get_current_node
+        self.get_candidates = get_candidates or get_available_nodes
+        self.apply = apply or apply_node_config
+        self.current_key = None
+        self.degraded_checks = 0
+        self.last_failover = None
+
+    def window_stats(self):
+        """Return (median latency or None, failure rate %) over the window"""
+        if not self.window:
+            return None, 0
+        latencies = [latency for _, latency in self.window if latency is not None]
+        failure_rate = 100 - statistics.fmean(rate for rate, _ in self.window)
+        return (statistics.median(latencies) if latencies else None), failure_rate
+
+    def is_degraded(self):
+        """Check whether the window crosses the latency or failure thresholds"""
+        if len(self.window) < self.min_samples:
+            return False
+        latency, failure_rate = self.window_stats()
+        return failure_rate > self.max_failure_rate or latency is None or latency > self.max_latency
+
+    def find_standby(self, current):
+        """Probe the best history candidates and return the best online standby, or None"""
+        current_key = node_identity(current)
+        candidates = [n for n in self.get_candidates() if is_valid_node(n) and node_identity(n) != current_key]
+        candidates = rank_nodes_by_history(candidates)[:HISTORY_CANDIDATES]
+        results = probe_nodes(candidates, timeout=self.timeout)
+        record_probe_results(results)
+        online = [r for r in results if r["status"] == "online"]
+        return min(online, key=node_rank_score) if online else None
+
+    def check_once(self, now=None):
+        """Run one monitoring step, returns "idle", "ok", "degraded", "cooldown", "no-standby" or "failover" """
+        now = time.monotonic() if now is None else now
+        current = self.get_current()
+        if not current:
+            log("Monitor: unable to identify current node", "WARNING")
+            return "idle"
+
+        key = node_identity(current)
+        if key != self.current_key:
+            # Node changed (by us or by hand): start a fresh window
+            self.current_key = key
+            self.window.clear()
+            self.degraded_checks = 0
+
+        result = test_node_latency(current, timeout=self.timeout)
+        record_probe_results([{**current, **result}])
+        self.window.append((result["success_rate"], result["latency"] if result["status"] == "online" else None))
+
+        if not self.is_degraded():
+            self.degraded_checks = 0
+            return "ok"
+
+        self.degraded_checks += 1
+        latency, failure_rate = self.window_stats()
+        latency_text = f"{latency:.1f}ms" if latency is not None else "offline"
+        log(f"Monitor: {current['name']} degraded ({latency_text}, {failure_rate:.0f}% failures), "
+            f"check {self.degraded_checks}/{self.trigger_count}", "WARNING")
+        if self.degraded_checks < self.trigger_count:
+            return "degraded"
+        if self.last_failover is not None and now - self.last_failover < self.cooldown:
+            return "cooldown"
+
+        standby = self.find_standby(current)
+        if not standby or (latency is not None and failure_rate <= self.max_failure_rate
+                           and node_rank_score(standby) >= latency * (1 - MONITOR_IMPROVEMENT)):
+            log("Monitor: no clearly better standby node available", "WARNING")
+            return "no-standby"
+
+        log(f"Monitor: failing over {current['name']} -> {standby['name']} ({standby['latency']:.1f}ms)", "INFO")
+        self.last_failover = now
+        if self.apply(standby):
+            self.current_key = node_identity(standby)
+            self.window.clear()
+            self.degraded_checks = 0
+            return "failover"
+        log("Monitor: failover failed", "ERROR")
+        return "degraded"
+
+    def run(self):
+        """Monitor until interrupted"""
+        log(f"Node monitor started (interval {self.interval}s, max latency {self.max_latency}ms, "
+            f"max failure rate {self.max_failure_rate}%, cooldown {self.cooldown}s)", "INFO")
+        while True:
             try:
-                result = future.result()
-                node_result = {**node, **result}
-                results.append(node_result)
-
-                # Prepare column data
-                name = node['name']
-                region = node.get('region', 'Unknown')
-
-                # Display results in real-time
-                if result["status"] == "online":
-                    latency_val = f"{result['latency']:.1f}"
-                    if result['latency'] <= 80:
-                        latency_colored = f"{Colors.GREEN}{latency_val}{Colors.END}"
-                    elif result['latency'] <= 150:
-                        latency_colored = f"{Colors.YELLOW}{latency_val}{Colors.END}"
-                    else:
-                        latency_colored = f"{Colors.RED}{latency_val}{Colors.END}"
-
-                    # Format success rate with color
-                    success_rate = result['success_rate']
-                    success_rate_val = f"{success_rate:.0f}%"
-                    if success_rate >= 90:
-                        success_rate_colored = f"{Colors.GREEN}{success_rate_val}{Colors.END}"
-                    elif success_rate >= 80:
-                        success_rate_colored = f"{Colors.YELLOW}{success_rate_val}{Colors.END}"
-                    else:
-                        success_rate_colored = f"{Colors.RED}{success_rate_val}{Colors.END}"
-
-                    # Build output line
-                    line = (
-                        f"{pad_to_width(name, NAME_WIDTH)}"
-                        f"{pad_to_width(region, REGION_WIDTH)}"
-                        f"{Colors.GREEN}Online{Colors.END}{' ' * (STATUS_WIDTH - get_display_width('Online'))}"
-                        f"{latency_colored}{' ' * (LATENCY_WIDTH - get_display_width(latency_val))}"
-                        f"{success_rate_colored}"
-                    )
-                else:
-                    # Offline status
-                    success_rate = result['success_rate']
-                    success_rate_val = f"{success_rate:.0f}%"
-                    success_rate_colored = f"{Colors.RED}{success_rate_val}{Colors.END}"
-
-                    line = (
-                        f"{pad_to_width(name, NAME_WIDTH)}"
-                        f"{pad_to_width(region, REGION_WIDTH)}"
-                        f"{Colors.RED}Offline{Colors.END}{' ' * (STATUS_WIDTH - get_display_width('Offline'))}"
-                        f"-{' ' * (LATENCY_WIDTH - 1)}"
-                        f"{success_rate_colored}"
-                    )
-
-                print(line)
-
+                self.check_once()
             except Exception as e:
-                # Error handling
-                line = (
-                    f"{pad_to_width(node['name'], NAME_WIDTH)}"
-                    f"{pad_to_width(node.get('region', 'Unknown'), REGION_WIDTH)}"
-                    f"{Colors.RED}Error{Colors.END}"
-                )
-                print(line)
+                log(f"Monitor check failed: {str(e)}", "ERROR")
+            time.sleep(self.interval)
 
-    print("="*85)
+def monitor_cli_args(options):
+    """Validate "monitor" command line options
 
-    # Statistics
-    online_nodes = [n for n in results if n["status"] == "online"]
-    if online_nodes:
-        avg_latency = sum(n["latency"] for n in online_nodes) / len(online_nodes)
-        best_node = min(online_nodes, key=lambda x: x["latency"])
-        print(f"\nOnline nodes: {len(online_nodes)}/{len(valid_nodes)}")
-        print(f"Average latency: {avg_latency:.1f}ms")
-        print(f"\n{Colors.GREEN}Recommended node: {best_node['name']} (Latency: {best_node['latency']:.1f}ms){Colors.END}")
-        return best_node
-    else:
-        print(f"\n{Colors.RED}All nodes are unreachable!{Colors.END}")
-        return None
+    Returns (NodeMonitor keyword arguments, the same options as an argument
+    list for a service command). Raises ValueError on a malformed value.
+    """
+    settings, args = {}, []
+    for option, (name, kind) in MONITOR_CLI_OPTIONS.items():
+        if option in options:
+            value = kind(options[option])
+            if value < 0:
+                raise ValueError(f"--{option} must not be negative")
+            settings[name] = value
+            args += [f"--{option}", str(value)]
+    return settings, args
 
 def configure_system_proxy():
     """Configure system proxy"""
@@ -1360,49 +3708,187 @@ fi
     log("Available commands: proxy_on, proxy_off, proxy_status, proxy_mode_*, proxy_help", "INFO")
     log(f"For current session, run: source ~/{shell_rc}", "INFO")
 
-def save_subscription(url, nodes):
-    """Save subscription information"""
-    # Load existing config to preserve proxy settings
-    existing_config = load_subscription()
+# Fields that describe a node without affecting how it connects
+NODE_META_FIELDS = ["name", "region", "source"]
 
-    subscription_data = {
-        "url": url,
-        "nodes": nodes,
-        "update_time": int(time.time()),
-        "selected_index": 0,
-        "proxy_mode": existing_config.get("proxy_mode", "direct") if existing_config else "direct",
-        "static_proxy": existing_config.get("static_proxy", get_static_proxy_config()) if existing_config else get_static_proxy_config()
-    }
+def diff_subscription_nodes(old_nodes, new_nodes):
+    """Diff two node lists by node_identity
 
-    # Backup existing configuration
-    if os.path.exists(CONFIG.SUBSCRIPTION_FILE):
-        shutil.copy(CONFIG.SUBSCRIPTION_FILE, f"{CONFIG.SUBSCRIPTION_FILE}.backup")
+    Returns a dict of node lists: "added", "removed", "changed" (same
+    identity, different connection settings) and "unchanged" (which may
+    have been renamed), plus the "renamed" count.
+    """
+    def settings(node):
+        return {k: v for k, v in node.items() if k not in NODE_META_FIELDS}
+
+    old_by_key = {node_identity(node): node for node in old_nodes}
+    new_keys = set()
+    diff = {"added": [], "removed": [], "changed": [], "unchanged": [], "renamed": 0}
+    for node in new_nodes:
+        key = node_identity(node)
+        new_keys.add(key)
+        old = old_by_key.get(key)
+        if old is None:
+            diff["added"].append(node)
+        elif settings(old) != settings(node):
+            diff["changed"].append(node)
+        else:
+            diff["unchanged"].append(node)
+            diff["renamed"] += old.get("name") != node.get("name")
+    diff["removed"] = [node for key, node in old_by_key.items() if key not in new_keys]
+    return diff
+
+def save_subscription(url, nodes, sources=None):
+    """Save subscription information
+
+    sources is the optional per-source summary (see summarize_sources) when
+    nodes were merged from several subscriptions; url is then the first one.
+
+    The update is applied as a diff against the stored list: the selected
+    node keeps its selection, unchanged nodes keep their history, changed
+    nodes lose their now-stale history, and new or changed nodes are added
+    to "probe_queue" (see probe_pending_nodes). Returns the diff.
+    """
+    nodes = [as_node(node) for node in nodes]
+    existing_config = load_subscription()
+    old_nodes = query_nodes()
+    diff = diff_subscription_nodes(old_nodes, nodes)
+    old_keys = [node_identity(node) for node in old_nodes]
+    new_keys = [node_identity(node) for node in nodes]
+
+    # Keep the selection on the same node if it survived the update
+    selected_index = 0
+    if existing_config and 0 <= existing_config.get("selected_index", 0) < len(old_nodes):
+        selected_key = old_keys[existing_config.get("selected_index", 0)]
+        if selected_key in new_keys:
+            selected_index = new_keys.index(selected_key)
+
+    # Queue new/changed nodes for probing, keeping earlier entries that still exist
+    current_keys = set(new_keys)
+    previous_queue = existing_config.get("probe_queue", []) if existing_config else []
+    probe_queue = list(dict.fromkeys(
+        [key for key in previous_queue if key in current_keys] +
+        [node_identity(node) for node in diff["added"] + diff["changed"]]))
+
+    # Only rows that are new, changed, renamed or moved get written
+    old_positions = {key: i for i, key in enumerate(old_keys)}
+    rows = []
+    written = {}
+    for node, key in zip(nodes, new_keys):
+        if key in written:
+            continue
+        written[key] = position = len(written)
+        if old_positions.get(key) != position or old_nodes[old_positions[key]] != node:
+            rows.append(_node_row(node, position))
+    sources = sources or [{"name": "default", "url": url}]
 
-    with open(CONFIG.SUBSCRIPTION_FILE, 'w', encoding='utf-8') as f:
-        json.dump(subscription_data, f, indent=2, ensure_ascii=False)
+    # Backup existing configuration
+    if existing_config:
+        backup_node_store()
+
+    db = get_node_store()
+    with _NODE_STORE_LOCK, db:
+        db.executemany("DELETE FROM nodes WHERE identity = ?", [(node_identity(n),) for n in diff["removed"]])
+        db.executemany("INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        db.execute("DELETE FROM sources")
+        db.executemany("INSERT INTO sources VALUES (?, ?, ?, ?, ?)",
+                       [(i, s["name"], s["url"], s.get("status"), s.get("nodes")) for i, s in enumerate(sources)])
+        # Latency history of a node whose connection settings changed no longer applies
+        db.executemany("DELETE FROM probe_results WHERE identity = ?", [(node_identity(n),) for n in diff["changed"]])
+        settings = {"url": url, "update_time": int(time.time()), "selected_index": selected_index,
+                    "probe_queue": probe_queue,
+                    "source_versions": {s["url"]: s.get("version") for s in sources}}
+        db.executemany("INSERT OR REPLACE INTO settings VALUES (?, ?)",
+                       [(key, json.dumps(value, ensure_ascii=False)) for key, value in settings.items()])
+        # Proxy settings are kept; the first subscription starts from the defaults
+        defaults = {"proxy_mode": "direct", "static_proxy": get_static_proxy_config(), "balancer": BALANCER_DEFAULTS}
+        db.executemany("INSERT OR IGNORE INTO settings VALUES (?, ?)",
+                       [(key, json.dumps(value, ensure_ascii=False)) for key, value in defaults.items()])
 
     log("Subscription information saved", "SUCCESS")
+    return diff
+
+def print_subscription_diff(diff, limit=10):
+    """Print the added / removed / changed nodes of a subscription update"""
+    print(f"\nChanges: {Colors.GREEN}+{len(diff['added'])} added{Colors.END}, "
+          f"{Colors.RED}-{len(diff['removed'])} removed{Colors.END}, "
+          f"{Colors.YELLOW}~{len(diff['changed'])} changed{Colors.END}, "
+          f"{len(diff['unchanged'])} unchanged ({diff['renamed']} renamed)")
+    for symbol, color, key in [("+", Colors.GREEN, "added"), ("-", Colors.RED, "removed"), ("~", Colors.YELLOW, "changed")]:
+        for node in diff[key][:limit]:
+            print(f"  {color}{symbol} {node.get('name', 'Unknown')} ({node.get('region', 'Unknown')}){Colors.END}")
+        if len(diff[key]) > limit:
+            print(f"  {color}{symbol} ... and {len(diff[key]) - limit} more{Colors.END}")
+
+def probe_pending_nodes():
+    """Probe the nodes queued by subscription updates and record them in the history"""
+    queued = get_setting("probe_queue", [])
+    if not queued:
+        return []
+
+    nodes = [node for node in query_nodes(f"identity IN ({', '.join('?' * len(queued))})", queued)
+             if is_valid_node(node)]
+    results = probe_nodes(nodes) if nodes else []
+    record_probe_results(results)
+
+    # Re-read in case the subscription changed while probing
+    queued = set(queued)
+    set_setting("probe_queue", [key for key in get_setting("probe_queue", []) if key not in queued])
+    return results
 
 def load_subscription():
-    """Load subscription information"""
+    """Load subscription information (without the node list)
+
+    Returns the stored settings plus "sources" and "node_count", or None
+    when no subscription was saved yet. Nodes are read with
+    get_available_nodes / query_nodes, single settings with get_setting.
+    """
     try:
-        if os.path.exists(CONFIG.SUBSCRIPTION_FILE):
-            with open(CONFIG.SUBSCRIPTION_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return None
+        with _NODE_STORE_LOCK:
+            rows = get_node_store().execute("SELECT key, value FROM settings").fetchall()
+        subscription = {key: json.loads(value) for key, value in rows}
+        if "update_time" not in subscription:
+            return None
+        return {**subscription, "sources": get_sources(), "node_count": count_nodes()}
     except Exception as e:
         log(f"Failed to load subscription configuration: {str(e)}", "ERROR")
         return None
 
 def apply_node_config(node):
     """Apply node configuration"""
-    # Load subscription to get proxy mode
-    subscription = load_subscription()
-    proxy_mode = subscription.get("proxy_mode", "direct") if subscription else "direct"
-    static_proxy_config = subscription.get("static_proxy", get_static_proxy_config()) if subscription else get_static_proxy_config()
+    proxy_mode = get_proxy_mode()
+    static_proxy_config = get_setting("static_proxy") or get_static_proxy_config()
+
+    # Balanced mode spreads traffic over the node plus the best nodes from history
+    balancer = {**BALANCER_DEFAULTS, **get_setting("balancer", {})}
+    balancer_nodes = select_balancer_nodes(node, balancer["count"]) if proxy_mode == "balanced" else None
+    if balancer_nodes is not None and len(balancer_nodes) + 1 < BALANCER_MIN_NODES:
+        log(f"Balanced mode needs at least {BALANCER_MIN_NODES} valid nodes, using {node['name']} alone", "WARNING")
+
+    # Pin each node to the address family that connected fastest when probed
+    history = load_history()
+    node = with_preferred_family(node, history)
+    if balancer_nodes:
+        balancer_nodes = [with_preferred_family(n, history) for n in balancer_nodes]
 
     # Generate new configuration with proxy mode
-    config = generate_v2ray_config(node, proxy_mode, static_proxy_config)
+    config = generate_v2ray_config(node, proxy_mode, static_proxy_config, balancer_nodes, balancer["strategy"])
+
+    # Nothing to do when the running service already uses this exact configuration
+    try:
+        active_config = read_json_state(CONFIG.CONFIG_FILE)
+    except Exception:
+        active_config = None
+    changes = None
+    if active_config is not None:
+        if config_hash(active_config) == config_hash(config):
+            if PLATFORM_HANDLER.is_service_active():
+                record_active_node(node, balanced_outbound_count(config))
+                log(f"Configuration unchanged, V2Ray keeps using node: {node['name']}", "SUCCESS")
+                return True
+        else:
+            changes = diff_config_sections(active_config, config)
+            log(f"Configuration changes: {format_config_changes(changes)}", "INFO")
     
     # Create config directory if not exists
     os.makedirs(CONFIG.CONFIG_DIR, exist_ok=True)
@@ -1413,8 +3899,7 @@ def apply_node_config(node):
     
     # Save configuration
     try:
-        with open(CONFIG.CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
+        write_json_state(CONFIG.CONFIG_FILE, config)
         log(f"Configuration saved to: {CONFIG.CONFIG_FILE}", "INFO")
     except Exception as e:
         log(f"Failed to save config: {str(e)}", "ERROR")
@@ -1430,6 +3915,16 @@ def apply_node_config(node):
             shutil.copy(f"{CONFIG.CONFIG_FILE}.backup", CONFIG.CONFIG_FILE)
         return False
     
+    # Outbound-only changes are swapped into the running service, keeping its connections
+    if changes and can_hot_swap(active_config, config, changes) and PLATFORM_HANDLER.is_service_active():
+        try:
+            hot_swap_outbounds(config, changes)
+            record_active_node(node, balanced_outbound_count(config))
+            log(f"V2Ray switched without restart, using node: {node['name']}", "SUCCESS")
+            return True
+        except Exception as e:
+            log(f"Hot swap failed ({str(e)}), restarting V2Ray", "WARNING")
+    
     # Create service if not exists (for macOS)
     if IS_MACOS and not PLATFORM_HANDLER.is_service_active():
         PLATFORM_HANDLER.create_service()
@@ -1441,18 +3936,23 @@ def apply_node_config(node):
     # Check service status
     time.sleep(2)
     if PLATFORM_HANDLER.is_service_active():
+        # Only recorded once V2Ray actually runs this config
+        record_active_node(node, balanced_outbound_count(config))
         log(f"V2Ray service started, using node: {node['name']}", "SUCCESS")
         return True
     else:
         log("V2Ray service failed to start", "ERROR")
         return False
 
+def select_balancer_nodes(primary, count):
+    """Pick count-1 extra nodes to balance with the primary node, best history first"""
+    primary_key = node_identity(primary)
+    candidates = [n for n in get_available_nodes() if is_valid_node(n) and node_identity(n) != primary_key]
+    return rank_nodes_by_history(candidates)[:max(count - 1, 0)]
+
 def get_proxy_mode():
     """Get current proxy mode"""
-    subscription = load_subscription()
-    if subscription:
-        return subscription.get("proxy_mode", "direct")
-    return "direct"
+    return get_setting("proxy_mode", "direct")
 
 def configure_static_proxy():
     """Configure static IP proxy"""
@@ -1460,12 +3960,11 @@ def configure_static_proxy():
     print("Configure Static IP Proxy (Level-2 Proxy Configuration)")
     print("="*60)
 
-    subscription = load_subscription()
-    if not subscription:
+    if not load_subscription():
         log("No subscription configuration found. Please run Quick Start first.", "ERROR")
         return
 
-    current_config = subscription.get("static_proxy", get_static_proxy_config())
+    current_config = get_setting("static_proxy") or get_static_proxy_config()
 
     print(f"\nCurrent configuration:")
     print(f"  Server: {current_config.get('server')}")
@@ -1490,34 +3989,30 @@ def configure_static_proxy():
         "protocol": protocol if protocol in ['http', 'socks5'] else current_config.get('protocol')
     }
 
-    # Save to subscription
-    subscription["static_proxy"] = new_config
-
     try:
-        with open(CONFIG.SUBSCRIPTION_FILE, 'w', encoding='utf-8') as f:
-            json.dump(subscription, f, indent=2, ensure_ascii=False)
+        set_setting("static_proxy", new_config)
         log("Static proxy configuration saved", "SUCCESS")
 
         # Ask if want to apply changes
-        if subscription.get("proxy_mode") == "chained":
+        if get_proxy_mode() == "chained":
             apply = input("\nApply changes now (restart V2Ray)? (y/n): ").strip().lower()
             if apply == 'y':
                 apply_proxy_mode("chained")
     except Exception as e:
         log(f"Failed to save configuration: {str(e)}", "ERROR")
 
-def toggle_proxy_mode(target_mode=None):
-    """Toggle proxy mode between direct and chained
+def toggle_proxy_mode(target_mode=None, balancer=None):
+    """Toggle proxy mode between direct and chained, or switch to balanced
 
     Args:
-        target_mode: "direct", "chained", or None (auto toggle)
+        target_mode: "direct", "chained", "balanced", or None (auto toggle)
+        balancer: Optional {"count", "strategy"} settings for balanced mode
     """
-    subscription = load_subscription()
-    if not subscription:
+    if not load_subscription():
         log("No subscription configuration found. Please run Quick Start first.", "ERROR")
         return
 
-    current_mode = subscription.get("proxy_mode", "direct")
+    current_mode = get_proxy_mode()
 
     # Determine target mode
     if target_mode is None:
@@ -1526,22 +4021,39 @@ def toggle_proxy_mode(target_mode=None):
     else:
         new_mode = target_mode
 
-    if new_mode not in ["direct", "chained"]:
-        log("Invalid proxy mode. Use 'direct' or 'chained'", "ERROR")
+    if new_mode not in PROXY_MODES:
+        log("Invalid proxy mode. Use 'direct', 'chained' or 'balanced'", "ERROR")
         return
 
-    if current_mode == new_mode:
+    if balancer:
+        if balancer.get("strategy", BALANCER_DEFAULTS["strategy"]) not in BALANCER_STRATEGIES:
+            log(f"Invalid balancer strategy. Use one of: {', '.join(BALANCER_STRATEGIES)}", "ERROR")
+            return
+        if balancer.get("count", BALANCER_DEFAULTS["count"]) < BALANCER_MIN_NODES:
+            log(f"Balanced mode needs at least {BALANCER_MIN_NODES} nodes", "ERROR")
+            return
+        balancer = {**BALANCER_DEFAULTS, **get_setting("balancer", {}), **balancer}
+    elif current_mode == new_mode:
         log(f"Already in {new_mode} mode", "INFO")
         return
 
-    print(f"\nSwitching proxy mode: {current_mode} -> {new_mode}")
+    # Too few valid nodes would silently generate the direct layout
+    if new_mode == "balanced":
+        selected_node = get_selected_node()
+        if not selected_node:
+            return
+        count = (balancer or {**BALANCER_DEFAULTS, **get_setting("balancer", {})})["count"]
+        available = len(select_balancer_nodes(selected_node, count)) + 1
+        if available < BALANCER_MIN_NODES:
+            log(f"Balanced mode needs at least {BALANCER_MIN_NODES} valid nodes, only {available} available", "ERROR")
+            return
 
-    # Update mode in subscription
-    subscription["proxy_mode"] = new_mode
+    print(f"\nSwitching proxy mode: {current_mode} -> {new_mode}")
 
     try:
-        with open(CONFIG.SUBSCRIPTION_FILE, 'w', encoding='utf-8') as f:
-            json.dump(subscription, f, indent=2, ensure_ascii=False)
+        if balancer:
+            set_setting("balancer", balancer)
+        set_setting("proxy_mode", new_mode)
 
         # Apply new mode
         apply_proxy_mode(new_mode)
@@ -1549,78 +4061,52 @@ def toggle_proxy_mode(target_mode=None):
     except Exception as e:
         log(f"Failed to switch proxy mode: {str(e)}", "ERROR")
 
+def get_selected_node():
+    """Node V2Ray is currently configured for, or None (with an error logged)"""
+    try:
+        selected_node, _ = get_active_node()
+    except FileNotFoundError:
+        log("No V2Ray configuration found. Please select a node first.", "ERROR")
+        return None
+    except ValueError:
+        log("Invalid configuration format", "ERROR")
+        return None
+
+    if not selected_node:
+        # Rebuild the node from the current outbound (the primary node is always first)
+        selected_node = Node.from_outbound(read_json_state(CONFIG.CONFIG_FILE)["outbounds"][0])
+    return selected_node
+
 def apply_proxy_mode(mode):
     """Apply proxy mode (regenerate config and restart service)"""
     log(f"Applying proxy mode: {mode}", "INFO")
 
     # Get current node configuration
     try:
-        if not os.path.exists(CONFIG.CONFIG_FILE):
-            log("No V2Ray configuration found. Please select a node first.", "ERROR")
-            return False
-
-        with open(CONFIG.CONFIG_FILE, 'r') as f:
-            current_config = json.load(f)
-
-        # Extract current node info
-        if not current_config.get("outbounds"):
-            log("Invalid configuration format", "ERROR")
-            return False
-
-        # Find the proxy-node outbound (or first outbound)
-        node_outbound = None
-        for outbound in current_config["outbounds"]:
-            if outbound.get("tag") == "proxy-node" or not node_outbound:
-                node_outbound = outbound
-                if outbound.get("tag") == "proxy-node":
-                    break
-
-        if not node_outbound:
-            log("No valid outbound found", "ERROR")
-            return False
-
-        # Get server info from outbound
-        vnext = node_outbound.get("settings", {}).get("vnext", [])
-        if not vnext:
-            log("No server configuration found", "ERROR")
-            return False
-
-        server_info = vnext[0]
-
-        # Find matching node from available nodes
-        all_nodes = get_available_nodes()
-        selected_node = None
-
-        for node in all_nodes:
-            if (node.get("server") == server_info.get("address") and
-                node.get("port") == server_info.get("port")):
-                selected_node = node
-                break
-
+        selected_node = get_selected_node()
         if not selected_node:
-            # Create a basic node from current config
-            selected_node = {
-                "protocol": node_outbound.get("protocol", "vmess"),
-                "server": server_info.get("address"),
-                "port": server_info.get("port"),
-                "uuid": server_info.get("users", [{}])[0].get("id", DEFAULT_UUID),
-                "name": "Current Node"
-            }
+            return False
 
         # Regenerate and apply config
         if apply_node_config(selected_node):
-            mode_name = "Level-1 Proxy (Direct)" if mode == "direct" else "Level-2 Proxy (Chained)"
-            log(f"Successfully switched to {mode_name}", "SUCCESS")
+            log(f"Successfully switched to {PROXY_MODE_NAMES.get(mode, mode)}", "SUCCESS")
 
             # Show mode info
             if mode == "chained":
-                subscription = load_subscription()
-                static_config = subscription.get("static_proxy", get_static_proxy_config())
+                static_config = get_setting("static_proxy") or get_static_proxy_config()
                 print(f"\n{Colors.CYAN}Level-2 Proxy Information:{Colors.END}")
                 print(f"  Static IP: {static_config.get('server')}:{static_config.get('port')}")
                 print(f"  Protocol: {static_config.get('protocol').upper()}")
                 print(f"\n{Colors.YELLOW}Traffic Path:{Colors.END}")
                 print(f"  Local → V2Ray Node → Static IP({static_config.get('server')}) → Internet")
+            elif mode == "balanced":
+                balancer = {**BALANCER_DEFAULTS, **get_setting("balancer", {})}
+                # Report what was written; fewer nodes may exist than requested
+                count = balanced_outbound_count(read_json_state(CONFIG.CONFIG_FILE))
+                print(f"\n{Colors.PURPLE}Load Balancer Information:{Colors.END}")
+                print(f"  Nodes: {count}, Strategy: {balancer['strategy']}")
+                print(f"\n{Colors.YELLOW}Traffic Path:{Colors.END}")
+                print(f"  Local → Balancer → one of {count} V2Ray Nodes → Internet")
             else:
                 print(f"\n{Colors.YELLOW}Traffic Path:{Colors.END}")
                 print(f"  Local → V2Ray Node → Internet")
@@ -1638,14 +4124,22 @@ def test_proxy():
     """Test proxy connection"""
     log("Testing proxy connection...", "INFO")
 
-    test_urls = [
-        ("SOCKS5", "curl -s -x socks5h://127.0.0.1:20808 https://ipinfo.io/ip -m 10"),
-        ("HTTP", "curl -s -x http://127.0.0.1:20809 https://ipinfo.io/ip -m 10")
-    ]
-
-    for name, cmd in test_urls:
-        ip = run_command(cmd, check=False)
-        if ip and len(ip) < 20:
+    for name, proxy in [("SOCKS5", "socks"), ("HTTP", "http")]:
+        if proxy == "socks" and not socks_supported():
+            # Both inbounds route the same way, so the HTTP test below covers the exit path
+            socks = urlparse(LOCAL_PROXIES["socks"])
+            try:
+                socket.create_connection((socks.hostname, socks.port), timeout=5).close()
+                log(f"{name} inbound is listening on {socks.hostname}:{socks.port} "
+                    f"(exit IP checked through HTTP; pip install requests[socks] for a full SOCKS5 test)", "INFO")
+            except OSError:
+                log(f"{name} proxy test failed, nothing listening on {socks.hostname}:{socks.port}", "ERROR")
+            continue
+        try:
+            ip = http_get(f"{IP_INFO_URL}/ip", proxy=proxy).text.strip()
+        except Exception:
+            ip = None
+        if ip and len(ip) < 40:
             log(f"{name} proxy test successful, IP: {ip}", "SUCCESS")
         else:
             log(f"{name} proxy test failed", "ERROR")
@@ -1653,100 +4147,143 @@ def test_proxy():
 def get_current_ip():
     """Get current IP information"""
     try:
-        result = subprocess.run(
-            ["curl", "-s", "-x", "socks5h://127.0.0.1:20808", "https://ipinfo.io", "--connect-timeout", "5"],
-            capture_output=True,
-            text=True
-        )
-        if result.returncode == 0 and result.stdout:
-            data = json.loads(result.stdout)
+        # Both inbounds route the same way, so the HTTP one gives the same exit IP
+        response = http_get(IP_INFO_URL, proxy="socks" if socks_supported() else "http", timeout=5)
+        if response.ok:
+            data = response.json()
             return f"{data.get('ip', 'Unknown')} ({data.get('city', '')}, {data.get('country', '')})"
         else:
             return "Unable to get IP info"
     except Exception as e:
         return f"Error: {str(e)}"
 
+def balanced_outbound_count(config):
+    """Number of nodes sharing the load in a balanced config (0 for other modes)"""
+    return sum(1 for outbound in config.get("outbounds", [])
+               if outbound.get("tag", "").startswith(BALANCER_OUTBOUND_PREFIX))
+
+def record_active_node(node, balanced=0):
+    """Remember the node config.json was just written for (see get_active_node)"""
+    node = as_node(node)
+    stat = os.stat(CONFIG.CONFIG_FILE)
+    set_setting("active_node", {
+        "identity": node.identity,
+        "node": dict(node),
+        "balanced": balanced,
+        "config_stat": [stat.st_mtime_ns, stat.st_size]
+    })
+
+def get_active_node():
+    """(node, balanced count) of the active configuration
+
+    apply_node_config records the active node's identity together with the
+    mtime/size of config.json, so while the file is unchanged this is a
+    stat plus a primary-key lookup in the node store. A config written by
+    anything else is parsed once, matched on identity (protocol, server,
+    port, uuid/password) or endpoint, and recorded. node is None when the
+    config doesn't match a known node. Raises FileNotFoundError without a
+    config and ValueError for an invalid one.
+    """
+    stat = os.stat(CONFIG.CONFIG_FILE)
+    active = get_setting("active_node")
+    if active and active["config_stat"] == [stat.st_mtime_ns, stat.st_size]:
+        return get_node(active["identity"]) or Node.from_dict(active["node"]), active["balanced"]
+
+    config = read_json_state(CONFIG.CONFIG_FILE)
+    if not config or not config.get("outbounds") or not outbound_server(config["outbounds"][0]):
+        raise ValueError("Invalid configuration format")
+    current = Node.from_outbound(config["outbounds"][0])
+    node = get_node(current.identity) or find_node_by_endpoint(current["server"], current["port"])
+    balanced = balanced_outbound_count(config)
+    if node:
+        record_active_node(node, balanced)
+    return node, balanced
+
 def get_current_node_info():
     """Get current node information"""
-    config = None
-    
     try:
-        if os.path.exists(CONFIG.CONFIG_FILE):
-            with open(CONFIG.CONFIG_FILE, 'r') as f:
-                config = json.load(f)
-    except:
-        pass
-    
-    if not config:
+        node, balanced_count = get_active_node()
+    except FileNotFoundError:
         return "Configuration file not found"
-    
-    try:
-        # Check configuration structure
-        if ("outbounds" not in config or
-            not config["outbounds"] or
-            "settings" not in config["outbounds"][0] or
-            "vnext" not in config["outbounds"][0]["settings"] or
-            not config["outbounds"][0]["settings"]["vnext"]):
-            return "Invalid configuration format"
-        
-        current_server = config["outbounds"][0]["settings"]["vnext"][0]["address"]
-        current_port = config["outbounds"][0]["settings"]["vnext"][0]["port"]
-        
-        # Find matching node
-        all_nodes = get_available_nodes()
-        for node in all_nodes:
-            if node["server"] == current_server and node["port"] == current_port:
-                return f"{node['name']} ({node.get('region', 'Unknown')})"
-        
-        return "Unknown Node"
-    except:
+    except ValueError:
+        return "Invalid configuration format"
+    except Exception:
         return "Configuration file not found or invalid format"
 
-def get_available_nodes():
-    """Get all available nodes (subscription + built-in)"""
-    nodes = []
-    
-    # Load subscription nodes
-    subscription = load_subscription()
-    if subscription and subscription.get("nodes"):
-        nodes.extend(subscription["nodes"])
-    
-    # Add built-in nodes (if no subscription or need backup)
-    if not nodes:
-        # Convert built-in node format
-        for node in BUILTIN_NODES:
-            nodes.append({
-                **node,
-                "protocol": "vmess",
-                "uuid": DEFAULT_UUID
-            })
-    
+    # Balanced layout: the primary node plus the nodes sharing the load
+    balanced_suffix = f" + {balanced_count - 1} balanced" if balanced_count > 1 else ""
+    if node:
+        return f"{node['name']} ({node.get('region', 'Unknown')}){balanced_suffix}"
+    return f"Unknown Node{balanced_suffix}"
+
+def get_current_node():
+    """Get the node of the active configuration, or None"""
+    try:
+        return get_active_node()[0]
+    except Exception:
+        return None
+
+def get_builtin_nodes():
+    """Built-in nodes in the subscription node format"""
+    return [Node(**node, protocol="vmess", uuid=DEFAULT_UUID) for node in BUILTIN_NODES]
+
+def get_available_nodes(region=None, protocol=None):
+    """Get all available nodes (subscription + built-in), optionally of one region / protocol"""
+    conditions = {"region": region, "protocol": protocol}
+    conditions = {column: value for column, value in conditions.items() if value is not None}
+    nodes = query_nodes(" AND ".join(f"{column} = ?" for column in conditions), tuple(conditions.values()))
+
+    # Built-in nodes are used when no subscription is stored
+    if not nodes and not count_nodes():
+        nodes = [node for node in get_builtin_nodes()
+                 if all(node.get(column) == value for column, value in conditions.items())]
     return nodes
 
-def get_default_subscription_url():
-    """Get default subscription URL from subscription_url.ini"""
+def find_node_by_endpoint(server, port):
+    """The available node at server:port (looked up on the endpoint index), or None"""
+    nodes = query_nodes("server = ? AND port = ?", (server, port))
+    if not nodes and not count_nodes():
+        nodes = [node for node in get_builtin_nodes() if node["server"] == server and node["port"] == port]
+    return nodes[0] if nodes else None
+
+def get_subscription_sources():
+    """Get every subscription source from subscription_url.ini
+
+    Each section with a v2ray= URL is one source; gsou_cloud comes first,
+    the rest keep file order. An optional timeout= sets that source's
+    fetch timeout in seconds.
+
+    Returns:
+        list: [{"name": section, "url": url, "timeout": seconds}, ...]
+    """
     ini_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "subscription_url.ini")
     
     if not os.path.exists(ini_path):
-        return None
+        return []
     
+    sources = []
     try:
         config = configparser.ConfigParser()
         config.read(ini_path, encoding='utf-8')
-        
-        # Check for v2ray URL in gsou_cloud section
-        if config.has_section('gsou_cloud') and config.has_option('gsou_cloud', 'v2ray'):
-            return config.get('gsou_cloud', 'v2ray')
-            
-        # If not found in expected section, try to find any v2ray URL
-        for section in config.sections():
+
+        sections = sorted(config.sections(), key=lambda section: section != 'gsou_cloud')
+        for section in sections:
             if config.has_option(section, 'v2ray'):
-                return config.get(section, 'v2ray')
+                sources.append({
+                    "name": section,
+                    "url": config.get(section, 'v2ray'),
+                    "timeout": config.getfloat(section, 'timeout', fallback=SUBSCRIPTION_TIMEOUT)
+                })
                 
     except Exception as e:
-        log(f"Failed to read default subscription URL: {str(e)}", "WARNING")
+        log(f"Failed to read subscription URLs: {str(e)}", "WARNING")
     
-    return None
+    return sources
+
+def get_default_subscription_url():
+    """Get default subscription URL from subscription_url.ini"""
+    sources = get_subscription_sources()
+    return sources[0]["url"] if sources else None
 
 def quick_start():
     """Quick start (new user guide)"""
@@ -1770,35 +4307,65 @@ def quick_start():
     choice = input("\nPlease select [1-2]: ").strip()
     
     nodes = []
+    revalidation = None
     if choice == "1":
-        # Get default subscription URL
-        default_url = get_default_subscription_url()
+        # Get subscription URLs from subscription_url.ini
+        sources = get_subscription_sources()
         
-        if default_url:
-            print(f"\nFound default subscription URL:")
-            print(f"{Colors.CYAN}{default_url}{Colors.END}")
-            use_default = input("\nUse this default subscription URL? (y/n) [y]: ").strip().lower()
+        if sources:
+            print(f"\nFound default subscription URL{'s' if len(sources) > 1 else ''}:")
+            for source in sources:
+                print(f"{Colors.CYAN}[{source['name']}] {source['url']}{Colors.END}")
+            use_default = input("\nUse the default subscription URLs? (y/n) [y]: ").strip().lower()
             
-            if use_default in ['', 'y', 'yes']:
-                sub_url = default_url
-            else:
+            if use_default not in ['', 'y', 'yes']:
                 sub_url = input("\nPlease enter your V2Ray subscription URL: ").strip()
+                sources = [{"name": "manual", "url": sub_url, "timeout": SUBSCRIPTION_TIMEOUT}] if sub_url else []
         else:
             sub_url = input("\nPlease enter V2Ray subscription URL: ").strip()
+            sources = [{"name": "manual", "url": sub_url, "timeout": SUBSCRIPTION_TIMEOUT}] if sub_url else []
             
-        if sub_url:
-            nodes = parse_subscription(sub_url)
+        if sources:
+            sub_url = sources[0]["url"]
+            # Start from the cached node list right away and refresh it in the background
+            nodes = load_cached_subscriptions(sources)
+            if nodes:
+                log(f"Using cached subscription ({len(nodes)} nodes), revalidating in background", "INFO")
+                revalidation = start_subscription_revalidation(sources)
+                source_summary = [{"name": s["name"], "url": s["url"], "status": "cached"} for s in sources]
+            else:
+                log(f"Fetching {len(sources)} subscription(s)...", "INFO")
+                results = fetch_subscriptions(sources)
+                nodes = merge_subscription_nodes(results)
+                source_summary = summarize_sources(results)
+                log(f"Successfully parsed {len(nodes)} nodes", "SUCCESS")
             if nodes:
-                save_subscription(sub_url, nodes)
+                save_subscription(sub_url, nodes, source_summary)
     else:
-        nodes = [{**node, "protocol": "vmess", "uuid": DEFAULT_UUID} for node in BUILTIN_NODES]
+        nodes = get_builtin_nodes()
     
     if not nodes:
         log("No available nodes found", "ERROR")
         return False
     
-    # Test and select best node
-    best_node = test_all_nodes(nodes[:20])  # Test only first 20 nodes
+    # Select best node adaptively, trying the best nodes from history first
+    best_node = None
+    history = load_history()
+    candidates = [n for n in rank_nodes_by_history(nodes, history)
+                  if history_score(history.get(node_identity(n))) is not None][:HISTORY_CANDIDATES]
+    if candidates:
+        print(f"\nTesting {len(candidates)} best nodes from history first...")
+        best_node = select_best_node(candidates, time_budget=SELECT_TIME_BUDGET / 2)
+    if not best_node:
+        best_node = select_best_node(nodes)
+
+    # Pick up a changed subscription if the background revalidation has finished
+    if revalidation is not None:
+        revalidation.join(REVALIDATE_WAIT)
+        if revalidation.nodes:
+            log(f"Subscription changed upstream, saving {len(revalidation.nodes)} nodes", "INFO")
+            save_subscription(sub_url, revalidation.nodes, summarize_sources(revalidation.results))
+
     if best_node:
         if apply_node_config(best_node):
             configure_system_proxy()
@@ -1823,28 +4390,28 @@ def quick_start():
     
     return False
 
+def get_menu_nodes(history=None):
+    """Valid nodes in node list order: best-known first, based on latency history
+
+    Node numbers shown by switch_node and accepted by "speedtest --node"
+    index this list.
+    """
+    valid_nodes = [node for node in get_available_nodes() if is_valid_node(node)]
+    return rank_nodes_by_history(valid_nodes, history)
+
+def find_menu_node(choice, nodes=None):
+    """Node by its number in get_menu_nodes (1-based) or by name, None when nothing matches"""
+    nodes = get_menu_nodes() if nodes is None else nodes
+    if choice.isdigit():
+        idx = int(choice) - 1
+        return nodes[idx] if 0 <= idx < len(nodes) else None
+    return next((node for node in nodes if node["name"].lower() == choice.lower()), None)
+
 def switch_node():
     """Switch node"""
-    nodes = get_available_nodes()
-    if not nodes:
-        log("No available nodes", "ERROR")
-        return
-    
-    # Filter out non-node entries
-    def is_valid_node(node):
-        """Check if this is a valid VPN node"""
-        node_name = node.get('name', '').lower()
-        # Filter out subscription metadata entries
-        if any(keyword in node_name for keyword in ['remaining traffic', 'expiry time', 'traffic', 'expire', 'remaining']):
-            return False
-        # Check if node has required fields
-        if not node.get('server') or not node.get('port'):
-            return False
-        return True
-    
-    # Filter nodes
-    valid_nodes = [node for node in nodes if is_valid_node(node)]
-    
+    history = load_history()
+    valid_nodes = get_menu_nodes(history)
+
     if not valid_nodes:
         log("No valid nodes available", "ERROR")
         return
@@ -1865,7 +4432,12 @@ def switch_node():
     for region, region_nodes in regions.items():
         print(f"\n[{region}]")
         for i, node in region_nodes:
-            print(f"  {i+1:3d}. {node['name']:<30} {node['server']}:{node['port']}")
+            entry = history.get(node_identity(node))
+            if history_score(entry) is not None:
+                score = f"{entry['latency']:.0f}ms {entry['success'] * 100:.0f}%"
+            else:
+                score = "-"
+            print(f"  {i+1:3d}. {node['name']:<30} {node['server']}:{node['port']:<6} {score}")
 
     print("\n" + "="*60)
 
@@ -1974,46 +4546,63 @@ def apply_vmess_link():
 
 def update_subscription():
     """Update subscription"""
-    # Get subscription URL from subscription_url.ini
-    url = get_default_subscription_url()
+    # Get subscription URLs from subscription_url.ini
+    sources = get_subscription_sources()
     
-    if not url:
+    if not sources:
         log("No subscription URL found in subscription_url.ini", "ERROR")
         # Fallback to manual input
         url = input("\nPlease enter subscription URL: ").strip()
         if not url:
             log("Subscription URL cannot be empty", "ERROR")
             return
+        sources = [{"name": "manual", "url": url, "timeout": SUBSCRIPTION_TIMEOUT}]
     else:
-        print(f"\nUsing subscription URL from subscription_url.ini:")
-        print(f"{Colors.CYAN}{url}{Colors.END}")
+        print(f"\nUsing subscription URL{'s' if len(sources) > 1 else ''} from subscription_url.ini:")
+        for source in sources:
+            print(f"{Colors.CYAN}[{source['name']}] {source['url']}{Colors.END}")
         
         # Show previous subscription info if exists
         subscription = load_subscription()
         if subscription:
-            old_url = subscription.get("url", "")
+            old_urls = [s["url"] for s in subscription.get("sources", [{"url": subscription.get("url", "")}])]
             update_time = subscription.get("update_time", 0)
             last_update = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(update_time))
             
-            if old_url != url:
-                print(f"\nPrevious subscription URL: {old_url}")
+            if old_urls != [s["url"] for s in sources]:
+                print(f"\nPrevious subscription URLs: {', '.join(old_urls)}")
             print(f"Last update time: {last_update}")
         
         print("\nUpdating subscription...")
 
-    nodes = parse_subscription(url)
-    if nodes:
-        save_subscription(url, nodes)
+    results = fetch_subscriptions(sources)
+    for result in results:
+        status_color = {"modified": Colors.GREEN, "not_modified": Colors.GREEN}.get(result["status"], Colors.YELLOW)
+        print(f"  [{result['name']}] {status_color}{result['status']}{Colors.END}, {len(result['nodes'])} nodes")
 
-        # Display statistics
-        region_count = {}
-        for node in nodes:
-            region = node.get("region", "Unknown")
-            region_count[region] = region_count.get(region, 0) + 1
+    # All 304s mean the stored node list is already current
+    stored_urls = [s["url"] for s in get_sources()]
+    if all(r["status"] == "not_modified" for r in results) and stored_urls == [s["url"] for s in sources]:
+        log(f"Subscription not modified, keeping {count_nodes()} nodes", "SUCCESS")
+        return
 
-        print("\nSubscription updated successfully!")
-        for region, count in region_count.items():
-            print(f"  {region}: {count} nodes")
+    nodes = merge_subscription_nodes(results)
+    if nodes:
+        diff = save_subscription(sources[0]["url"], nodes, summarize_sources(results))
+
+        duplicates = sum(len(r["nodes"]) for r in results) - len(nodes)
+        print(f"\nSubscription updated successfully! ({len(nodes)} nodes, {duplicates} duplicates removed)")
+        print_subscription_diff(diff)
+
+        # Only new and changed nodes need testing; the rest keep their history
+        queued = len(get_setting("probe_queue", []))
+        if queued:
+            print(f"\nTesting {queued} new/changed nodes...")
+            results = probe_pending_nodes()
+            online = sum(1 for r in results if r["status"] == "online")
+            print(f"Online: {online}/{len(results)}")
+    else:
+        log("No nodes found in any subscription", "ERROR")
 
 def restore_backup():
     """Restore configuration backup"""
@@ -2023,8 +4612,8 @@ def restore_backup():
     if os.path.exists(f"{CONFIG.CONFIG_FILE}.backup"):
         backups.append(("V2Ray configuration", CONFIG.CONFIG_FILE, f"{CONFIG.CONFIG_FILE}.backup"))
 
-    if os.path.exists(f"{CONFIG.SUBSCRIPTION_FILE}.backup"):
-        backups.append(("Subscription configuration", CONFIG.SUBSCRIPTION_FILE, f"{CONFIG.SUBSCRIPTION_FILE}.backup"))
+    if os.path.exists(f"{CONFIG.NODE_STORE_FILE}.backup"):
+        backups.append(("Subscription configuration", CONFIG.NODE_STORE_FILE, f"{CONFIG.NODE_STORE_FILE}.backup"))
 
     if os.path.exists(f"{CONFIG.PROXYCHAINS_CONFIG}.backup"):
         proxychains_name = "proxychains-ng" if IS_MACOS else "ProxyChains4"
@@ -2046,7 +4635,10 @@ def restore_backup():
         idx = int(choice) - 1
         if 0 <= idx < len(backups):
             name, target, backup = backups[idx]
-            shutil.copy(backup, target)
+            if target == CONFIG.NODE_STORE_FILE:
+                restore_node_store(backup)
+            else:
+                shutil.copy(backup, target)
             log(f"{name} restored", "SUCCESS")
 
             if "V2Ray" in name:
@@ -2145,11 +4737,26 @@ def show_help():
     start               Start V2Ray service
     stop                Stop V2Ray service
     restart             Restart V2Ray service
-    test                Test proxy connection
+    test                Test proxy connection (full SOCKS5 check needs PySocks: pip install requests[socks])
+    speedtest [options] Download throughput test through a node
+      --node N|NAME     Node number or name from the node list (default: current node)
+      --streams N       Parallel download streams (default: 4)
+      --duration S      Seconds to download (default: 10)
+      --url URL         Download source
+    monitor [options]   Watch the current node and fail over when it degrades
+      install           Install the monitor as a service next to V2Ray (keeps the options below)
+      --interval S      Seconds between checks (default: 30)
+      --max-latency MS  Median latency that counts as degraded (default: 300)
+      --max-failure P   Failure rate (%) that counts as degraded (default: 50)
+      --cooldown S      Minimum seconds between failovers (default: 600)
+      --min-samples N   Checks needed before the node is judged (default: 3)
     mode <action>       Proxy mode management
       direct            Switch to Level-1 Proxy (Direct mode)
       chained           Switch to Level-2 Proxy (Chained mode)
-      toggle            Toggle between modes
+      balanced          Spread traffic over several nodes with a V2Ray balancer
+        --nodes N       Number of balanced nodes, at least 2 (default: 4)
+        --strategy S    random or leastPing (default: leastPing)
+      toggle            Toggle between direct and chained modes
       status            Show current proxy mode
     (no command)        Enter interactive menu
 
@@ -2178,7 +4785,8 @@ def show_help():
 2. {Colors.BOLD}Node Management{Colors.END}
    - Switch nodes
    - Test current node
-   - Test all nodes
+   - Test all nodes (TCP, TLS handshake or real delay)
+   - Speed test (parallel-stream throughput)
 
 3. {Colors.BOLD}Subscription Management{Colors.END}
    - Add/update subscription
@@ -2193,6 +4801,7 @@ def show_help():
 5. {Colors.BOLD}Proxy Modes{Colors.END}
    - Direct Mode (Level-1): Local → V2Ray Node → Internet
    - Chained Mode (Level-2): Local → V2Ray Node → Static IP → Internet
+   - Balanced Mode: Local → Balancer → one of N V2Ray Nodes → Internet
    - Quick toggle between modes without changing nodes
 
 [Configuration Locations]
@@ -2230,16 +4839,14 @@ def show_status():
 
     # Proxy mode
     proxy_mode = get_proxy_mode()
-    mode_name = "Level-1 Proxy (Direct)" if proxy_mode == "direct" else "Level-2 Proxy (Chained)"
-    mode_color = Colors.GREEN if proxy_mode == "direct" else Colors.CYAN
+    mode_name = PROXY_MODE_NAMES.get(proxy_mode, proxy_mode)
+    mode_color = {"direct": Colors.GREEN, "chained": Colors.CYAN}.get(proxy_mode, Colors.PURPLE)
     print(f"Proxy Mode: {mode_color}{mode_name}{Colors.END}")
 
     # Show static proxy info if in chained mode
     if proxy_mode == "chained":
-        subscription = load_subscription()
-        if subscription:
-            static_config = subscription.get("static_proxy", get_static_proxy_config())
-            print(f"Static Proxy: {static_config.get('server')}:{static_config.get('port')} ({static_config.get('protocol').upper()})")
+        static_config = get_setting("static_proxy") or get_static_proxy_config()
+        print(f"Static Proxy: {static_config.get('server')}:{static_config.get('port')} ({static_config.get('protocol').upper()})")
 
     # Current node
     print(f"Current Node: {Colors.BOLD}{Colors.CYAN}{get_current_node_info()}{Colors.END}")
@@ -2253,7 +4860,7 @@ def show_status():
     # Subscription info
     subscription = load_subscription()
     if subscription:
-        node_count = len(subscription.get("nodes", []))
+        node_count = subscription["node_count"]
         update_time = subscription.get("update_time", 0)
         last_update = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(update_time))
         print(f"\nSubscription Nodes: {node_count}")
@@ -2292,16 +4899,14 @@ def show_proxy_status():
 
         # Show proxy mode
         proxy_mode = get_proxy_mode()
-        mode_name = "Level-1 Proxy (Direct)" if proxy_mode == "direct" else "Level-2 Proxy (Chained)"
-        mode_color = Colors.GREEN if proxy_mode == "direct" else Colors.CYAN
+        mode_name = PROXY_MODE_NAMES.get(proxy_mode, proxy_mode)
+        mode_color = {"direct": Colors.GREEN, "chained": Colors.CYAN}.get(proxy_mode, Colors.PURPLE)
         print(f"Proxy Mode: {mode_color}{mode_name}{Colors.END}")
 
         # Show static proxy info if in chained mode
         if proxy_mode == "chained":
-            subscription = load_subscription()
-            if subscription:
-                static_config = subscription.get("static_proxy", get_static_proxy_config())
-                print(f"Static Proxy: {Colors.CYAN}{static_config.get('server')}:{static_config.get('port')} ({static_config.get('protocol').upper()}){Colors.END}")
+            static_config = get_setting("static_proxy") or get_static_proxy_config()
+            print(f"Static Proxy: {Colors.CYAN}{static_config.get('server')}:{static_config.get('port')} ({static_config.get('protocol').upper()}){Colors.END}")
 
         print(f"Current Node: {Colors.CYAN}{get_current_node_info()}{Colors.END}")
 
@@ -2324,7 +4929,10 @@ def show_main_menu():
     """Display main menu"""
     # Get proxy mode for display
     proxy_mode = get_proxy_mode()
-    mode_display = f"{Colors.GREEN}Level-1 Proxy{Colors.END}" if proxy_mode == "direct" else f"{Colors.CYAN}Level-2 Proxy{Colors.END}"
+    mode_display = {
+        "direct": f"{Colors.GREEN}Level-1 Proxy{Colors.END}",
+        "chained": f"{Colors.CYAN}Level-2 Proxy{Colors.END}"
+    }.get(proxy_mode, f"{Colors.PURPLE}Load-Balanced{Colors.END}")
 
     print(f"\n{Colors.BOLD}V2Ray Cross-Platform Management Tool v3.0{Colors.END}")
     print(f"Platform: {Colors.CYAN}{platform.system()}{Colors.END}")
@@ -2337,6 +4945,7 @@ def show_main_menu():
     print("   21. Switch Node")
     print("   22. Test Current Node")
     print("   23. Test All Nodes")
+    print("   24. Speed Test Node")
     print("3. Subscription Management")
     print("   31. Update Subscription")
     print("   32. Apply Node As System Proxy")
@@ -2355,6 +4964,18 @@ def show_main_menu():
     print("0. Exit")
     print("="*60)
 
+def parse_cli_options(args):
+    """Parse "--key value" pairs from command line arguments"""
+    options = {}
+    i = 0
+    while i < len(args):
+        if args[i].startswith("--") and i + 1 < len(args):
+            options[args[i][2:]] = args[i + 1]
+            i += 2
+        else:
+            i += 1
+    return options
+
 def main():
     """Main function"""
     # Check command line arguments
@@ -2396,10 +5017,43 @@ def main():
             # Test proxy connection
             test_proxy()
             return 0
+        elif command in ["speedtest"]:
+            # Throughput test through a node
+            options = parse_cli_options(sys.argv[2:])
+            usage = (f"Usage: python3 {sys.argv[0]} speedtest [--node N|NAME] [--streams N] "
+                     f"[--duration S] [--url URL]")
+            try:
+                streams, duration = speed_test_settings(options.get("streams"), options.get("duration"))
+            except ValueError:
+                print(f"{Colors.YELLOW}{usage}{Colors.END}")
+                return 1
+            node = None
+            if "node" in options:
+                node = find_menu_node(options["node"])
+                if node is None:
+                    print(f"{Colors.YELLOW}Invalid node: {options['node']} (use a number or name from the node list){Colors.END}")
+                    print(usage)
+                    return 1
+            result = run_speed_test(node, url=options.get("url", SPEEDTEST_URL), streams=streams, duration=duration)
+            return 0 if result and result["status"] == "ok" else 1
+        elif command in ["monitor"]:
+            # Node health monitor with automatic failover
+            install = len(sys.argv) > 2 and sys.argv[2].lower() == "install"
+            try:
+                settings, monitor_args = monitor_cli_args(parse_cli_options(sys.argv[3:] if install else sys.argv[2:]))
+            except ValueError as e:
+                print(f"{Colors.YELLOW}Invalid monitor option: {e}{Colors.END}")
+                print(f"Usage: python3 {sys.argv[0]} monitor [install] "
+                      f"{' '.join(f'[--{option} N]' for option in MONITOR_CLI_OPTIONS)}")
+                return 1
+            if install:
+                return 0 if PLATFORM_HANDLER.create_monitor_service(monitor_args) else 1
+            NodeMonitor(**settings).run()
+            return 0
         elif command in ["mode"]:
             # Proxy mode operations
             if len(sys.argv) < 3:
-                print(f"{Colors.YELLOW}Usage: python3 {sys.argv[0]} mode <direct|chained|toggle|status>{Colors.END}")
+                print(f"{Colors.YELLOW}Usage: python3 {sys.argv[0]} mode <direct|chained|balanced|toggle|status>{Colors.END}")
                 return 1
 
             mode_action = sys.argv[2].lower()
@@ -2407,25 +5061,42 @@ def main():
                 toggle_proxy_mode("direct")
             elif mode_action == "chained":
                 toggle_proxy_mode("chained")
+            elif mode_action == "balanced":
+                options = parse_cli_options(sys.argv[3:])
+                balancer = {}
+                try:
+                    if "nodes" in options:
+                        balancer["count"] = int(options["nodes"])
+                except ValueError:
+                    balancer["count"] = 0
+                if "strategy" in options:
+                    balancer["strategy"] = options["strategy"]
+                if (balancer.get("count", BALANCER_MIN_NODES) < BALANCER_MIN_NODES
+                        or balancer.get("strategy", BALANCER_STRATEGIES[0]) not in BALANCER_STRATEGIES):
+                    print(f"{Colors.YELLOW}Usage: python3 {sys.argv[0]} mode balanced "
+                          f"[--nodes N (at least {BALANCER_MIN_NODES})] [--strategy {'|'.join(BALANCER_STRATEGIES)}]{Colors.END}")
+                    return 1
+                toggle_proxy_mode("balanced", balancer or None)
             elif mode_action == "toggle":
                 toggle_proxy_mode()
             elif mode_action == "status":
                 proxy_mode = get_proxy_mode()
-                mode_name = "Level-1 Proxy (Direct)" if proxy_mode == "direct" else "Level-2 Proxy (Chained)"
-                print(f"Current proxy mode: {mode_name}")
+                print(f"Current proxy mode: {PROXY_MODE_NAMES.get(proxy_mode, proxy_mode)}")
+                if proxy_mode == "balanced":
+                    balancer = {**BALANCER_DEFAULTS, **get_setting("balancer", {})}
+                    count = balanced_outbound_count(read_json_state(CONFIG.CONFIG_FILE) or {})
+                    print(f"Balancer: {count} of {balancer['count']} nodes, {balancer['strategy']} strategy")
                 if proxy_mode == "chained":
-                    subscription = load_subscription()
-                    if subscription:
-                        static_config = subscription.get("static_proxy", get_static_proxy_config())
-                        print(f"Static Proxy: {static_config.get('server')}:{static_config.get('port')} ({static_config.get('protocol').upper()})")
+                    static_config = get_setting("static_proxy") or get_static_proxy_config()
+                    print(f"Static Proxy: {static_config.get('server')}:{static_config.get('port')} ({static_config.get('protocol').upper()})")
             else:
                 print(f"{Colors.YELLOW}Invalid mode action: {mode_action}{Colors.END}")
-                print(f"Available actions: direct, chained, toggle, status")
+                print(f"Available actions: direct, chained, balanced, toggle, status")
                 return 1
             return 0
         else:
             print(f"{Colors.YELLOW}Unknown command: {command}{Colors.END}")
-            print(f"Available commands: help, status, start, stop, restart, test, mode")
+            print(f"Available commands: help, status, start, stop, restart, test, speedtest, monitor, mode")
             print(f"Run 'python3 {sys.argv[0]} --help' for more information")
             return 1
     
@@ -2452,31 +5123,30 @@ def main():
             
             elif choice == "22":
                 # Test current node
-                nodes = get_available_nodes()
-                current_node = None
-                
-                # Find current node
-                try:
-                    with open(CONFIG.CONFIG_FILE, 'r') as f:
-                        config = json.load(f)
-                    if config.get("outbounds"):
-                        current_server = config["outbounds"][0]["settings"]["vnext"][0]["address"]
-                        current_port = config["outbounds"][0]["settings"]["vnext"][0]["port"]
-                        
-                        for node in nodes:
-                            if node["server"] == current_server and node["port"] == current_port:
-                                current_node = node
-                                break
-                except:
-                    pass
+                current_node = get_current_node()
                 
                 if current_node:
                     print(f"\nCurrent node: {current_node['name']}")
                     result = test_node_latency(current_node, test_count=5)
                     if result["status"] == "online":
                         print(f"✓ Status: {result['status']}")
-                        print(f"✓ Latency: {result['latency']:.1f}ms")
+                        print(f"✓ Latency: {result['latency']:.1f}ms (p50)")
+                        print(f"✓ Min/P95/Max: {result['min']:.1f} / {result['p95']:.1f} / {result['max']:.1f}ms")
+                        print(f"✓ Jitter: ±{result['jitter']:.1f}ms")
+                        family = {"ipv4": "IPv4", "ipv6": "IPv6"}.get(result.get("family"), "unknown")
+                        print(f"✓ DNS: {result['dns_time']:.1f}ms ({result['address']}, {family})")
                         print(f"✓ Success rate: {result['success_rate']:.0f}%")
+
+                        # TLS handshake cost dominates first-byte latency through the proxy
+                        if current_node.get("tls") in ["tls", "xtls"]:
+                            tls_result = test_node_latency(current_node, test_count=5, mode="tls")
+                            if tls_result["status"] == "online":
+                                print(f"✓ TLS handshake: {tls_result['handshake_time']:.1f}ms "
+                                      f"(connect + handshake: {tls_result['latency']:.1f}ms)")
+                                print(f"✓ TLS version: {tls_result.get('tls_version')}, "
+                                      f"ALPN: {tls_result.get('alpn') or 'none'}")
+                            else:
+                                print(f"✗ TLS handshake failed: {tls_result.get('tls_error', 'unreachable')}")
                     else:
                         print(f"✗ Node is offline")
                 else:
@@ -2485,8 +5155,35 @@ def main():
             elif choice == "23":
                 # Test all nodes
                 nodes = get_available_nodes()
-                test_all_nodes(nodes)
+                probe_mode = input("Probe mode (tcp/tls/real) [tcp]: ").strip().lower() or "tcp"
+                delay_url = None
+                if probe_mode == "real":
+                    delay_url = input(f"Test URL [{REAL_DELAY_URL}]: ").strip() or None
+                test_all_nodes(nodes, mode=probe_mode, url=delay_url)
             
+            elif choice == "24":
+                # Speed test
+                # Numbered like the Switch Node list
+                nodes = get_menu_nodes()
+                prompt = f"Node number or name [1-{len(nodes)}, Enter for current node]: "
+                node_choice = input(prompt).strip()
+                current_node = find_menu_node(node_choice, nodes) if node_choice else get_current_node()
+
+                if current_node:
+                    streams = input(f"Parallel streams [{SPEEDTEST_STREAMS}]: ").strip()
+                    url = input(f"Download URL [{SPEEDTEST_URL}]: ").strip()
+                    try:
+                        stream_count, _ = speed_test_settings(streams)
+                    except ValueError:
+                        stream_count = None
+                        log(f"Invalid number of streams: {streams} (must be at least 1)", "ERROR")
+                    if stream_count:
+                        run_speed_test(current_node, url=url or SPEEDTEST_URL, streams=stream_count)
+                elif node_choice:
+                    log(f"Invalid node: {node_choice} (use a number or name from the node list)", "ERROR")
+                else:
+                    log("Unable to identify node", "ERROR")
+
             elif choice == "31":
                 # Update subscription
                 update_subscription()